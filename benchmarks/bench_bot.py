@@ -0,0 +1,236 @@
+# Нагрузочный бенчмарк бота без сети: main.bot направляется на фейковый Bot API,
+# через диспетчер прогоняется синтетический трафик, результат пишется в JSON.
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_bot --users 2000 --latency 0.02 --flood-rate 0.01 --output results.json
+#   python -m benchmarks.bench_bot --compare old.json new.json
+# Лимитер запросов пользователей по умолчанию отключен: каждый пользователь шлет
+# /refstats и листание подряд, и иначе большая часть обновлений упиралась бы в лимит.
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_telegram import (
+    BOT_TOKEN,
+    FakeTelegram,
+    make_callback_update,
+    make_message_update,
+)
+
+ADMIN_ID = 1
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ms = sorted(s * 1e3 for s in samples)
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.mean(ms), 3),
+        "p50_ms": round(ms[len(ms) // 2], 3),
+        "p99_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.99))], 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.dirname(__file__)),
+            text=True, stderr=subprocess.DEVNULL,
+        ).strip()
+    except Exception:
+        return None
+
+
+class ThrottleCounter:
+    # Обертка над RateLimiterMiddleware.check: считает отклоненные лимитером обновления,
+    # а без --rate-limit пропускает все, чтобы сценарии мерили обработчики, а не ответ
+    # «слишком много запросов»
+    def __init__(self, limiter, enabled):
+        self._check = limiter.check
+        self.enabled = enabled
+        self.count = 0
+        limiter.check = self.check
+
+    def check(self, user_id, cost=1, now=None):
+        if not self.enabled:
+            return True, 0.0
+        allowed, retry_after = self._check(user_id, cost, now)
+        if not allowed:
+            self.count += 1
+        return allowed, retry_after
+
+
+async def replay(main, updates, concurrency, throttle):
+    from aiogram.types import Update
+
+    throttled_before = throttle.count
+    latencies = []
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async def worker():
+        while not queue.empty():
+            raw = queue.get_nowait()
+            update = Update.model_validate(raw, context={"bot": main.bot})
+            start = time.perf_counter()
+            await main.dp.feed_update(main.bot, update)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "latency": percentiles(latencies),
+        "updates_per_sec": round(len(updates) / elapsed, 1),
+        "throttled": throttle.count - throttled_before,
+    }
+
+
+async def run(args):
+    tmp = tempfile.mkdtemp(prefix="bench-bot-")
+    os.environ["BOT_TOKEN"] = BOT_TOKEN
+    os.environ.setdefault("ADMIN_IDS", str(ADMIN_ID))
+    # main.py пишет bot.log и базу в текущий каталог
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, root)
+    os.chdir(tmp)
+
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import broadcast
+    import db
+    import main
+    import metrics
+
+    random.seed(args.seed)
+    users = list(range(10_000, 10_000 + args.users))
+    blocked = set(random.sample(users, int(len(users) * args.blocked_rate)))
+    fake = FakeTelegram(
+        latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate,
+        retry_after=args.retry_after, blocked=blocked,
+    )
+    base = await fake.start()
+
+    db.DB_PATH = os.path.join(tmp, "bench.sqlite3")
+    await db.init_db()
+    main.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(base))
+    main.bot.session.middleware(metrics.ApiMetricsMiddleware())
+    main.dp.include_router(main.router)
+    throttle = ThrottleCounter(main.rate_limiter, args.rate_limit)
+
+    update_ids = iter(range(1, 10**9))
+    results = {
+        "revision": git_revision(),
+        "params": vars(args),
+    }
+
+    # Волна /start: часть пользователей приходит по реферальным ссылкам первых 5%
+    referrers = users[: max(1, len(users) // 20)]
+    starts = []
+    for user_id in users:
+        text = f"/start {random.choice(referrers)}" if random.random() < args.referral_rate else "/start"
+        starts.append(make_message_update(next(update_ids), user_id, text))
+    results["start_burst"] = await replay(main, starts, args.concurrency, throttle)
+
+    # /refstats и листание страниц вперед по реальным курсорам
+    first_page = await db.get_referrers_page(10)
+    refstats = [make_message_update(next(update_ids), u, "/refstats") for u in random.sample(users, min(500, len(users)))]
+    if first_page:
+        last = first_page[-1]
+        data = f"refstats_2_n_{last['count']}_{last['user_id']}"
+        refstats += [make_callback_update(next(update_ids), u, data) for u in random.sample(users, min(500, len(users)))]
+    results["refstats"] = await replay(main, refstats, args.concurrency, throttle)
+
+    me = [make_message_update(next(update_ids), u, "/me") for u in random.sample(users, min(1000, len(users)))]
+    results["me"] = await replay(main, me, args.concurrency, throttle)
+
+    # Рассылка по всем активным пользователям через тот же движок, что и в боте
+    counts = await db.get_user_counts()
+    result = await broadcast.run_broadcast(
+        main.bot, db.iter_active_users(), ADMIN_ID, 1,
+        total=counts["active"], rate=args.rate, on_blocked=db.block_user,
+    )
+    results["broadcast"] = {
+        "recipients": result.total,
+        "delivered": result.success,
+        "blocked": result.blocked,
+        "errors": result.errors,
+        "retries": result.retries,
+        "elapsed_sec": round(result.elapsed, 3),
+        "msgs_per_sec": round(result.rate, 1),
+    }
+    results["api_calls"] = fake.calls
+    results["api_errors"] = fake.errors
+    with open(os.path.join(tmp, "metrics.txt"), "w", encoding="utf-8") as f:
+        f.write(metrics.render_prometheus())
+    results["metrics_file"] = os.path.join(tmp, "metrics.txt")
+
+    await main.bot.session.close()
+    await db.close_db()
+    await fake.stop()
+    return results
+
+
+def change(old, new):
+    return f"{(new - old) / old:+.0%}" if old else "n/a"
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old.get('revision')} -> {new.get('revision')}")
+    for scenario in ("start_burst", "refstats", "me"):
+        for key in ("p50_ms", "p99_ms"):
+            a, b = old[scenario]["latency"][key], new[scenario]["latency"][key]
+            print(f"{scenario:<12} {key:<8} {a:>10.2f} -> {b:>10.2f} ({change(a, b)})")
+        a, b = old[scenario]["updates_per_sec"], new[scenario]["updates_per_sec"]
+        print(f"{scenario:<12} {'upd/s':<8} {a:>10.1f} -> {b:>10.1f} ({change(a, b)})")
+        a, b = old[scenario].get("throttled", 0), new[scenario].get("throttled", 0)
+        if a or b:
+            print(f"{scenario:<12} {'throttled':<8} {a:>10} -> {b:>10}")
+    a, b = old["broadcast"]["msgs_per_sec"], new["broadcast"]["msgs_per_sec"]
+    print(f"{'broadcast':<12} {'msg/s':<8} {a:>10.1f} -> {b:>10.1f} ({change(a, b)})")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load benchmark against a fake Bot API")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--referral-rate", type=float, default=0.3)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа API, с")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--blocked-rate", type=float, default=0.05, help="доля пользователей с 403")
+    parser.add_argument("--rate", type=float, default=30, help="лимит рассылки, сообщ./с")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="не отключать лимитер запросов пользователей (отклоненные — в throttled)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    output = os.path.abspath(args.output) if args.output else None
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
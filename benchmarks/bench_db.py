@@ -0,0 +1,92 @@
+# Микробенчмарк задержки одного вызова БД:
+# старый подход (sqlite3.connect на каждый вызов) против постоянного соединения db.py.
+# Запуск из корня репозитория: python -m benchmarks.bench_db [N]
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import db
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def report(name, samples):
+    us = [s * 1e6 for s in samples]
+    print(
+        f"{name:<32} mean={statistics.mean(us):8.1f}us "
+        f"p50={percentile(us, 0.5):8.1f}us p99={percentile(us, 0.99):8.1f}us"
+    )
+
+
+def bench_connect_per_call(path, n, users):
+    reads, writes = [], []
+    for i in range(n):
+        user_id = random.choice(users)
+        start = time.perf_counter()
+        with sqlite3.connect(path) as conn:
+            conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        reads.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with sqlite3.connect(path) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO users (user_id, name, referral_id, is_blocked) VALUES (?, ?, ?, 0)",
+                (10_000_000 + i, "bench", None),
+            )
+        writes.append(time.perf_counter() - start)
+    return reads, writes
+
+
+async def bench_pooled(n, users):
+    reads, writes = [], []
+    for i in range(n):
+        user_id = random.choice(users)
+        start = time.perf_counter()
+        await db.get_user(user_id)
+        reads.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await db.add_user(20_000_000 + i, name="bench")
+        writes.append(time.perf_counter() - start)
+    return reads, writes
+
+
+async def main(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.sqlite3")
+        await db.init_db()
+        users = list(range(1, 10_001))
+        with sqlite3.connect(db.DB_PATH) as conn:
+            conn.executemany(
+                "INSERT INTO users (user_id, name) VALUES (?, ?)",
+                ((u, f"user {u}") for u in users),
+            )
+
+        reads, writes = bench_connect_per_call(db.DB_PATH, n, users)
+        report("connect-per-call get_user", reads)
+        report("connect-per-call add_user", writes)
+
+        reads, writes = await bench_pooled(n, users)
+        report("pooled async get_user", reads)
+        report("write-behind add_user (enqueue)", writes)
+
+        # Пачка, которую фоновая задача пишет одной транзакцией
+        for i in range(n):
+            await db.add_user(30_000_000 + i, name="bench")
+        start = time.perf_counter()
+        written = await db.flush_writes()
+        elapsed = time.perf_counter() - start
+        print(f"{'write-behind flush':<32} {written} rows in {elapsed * 1e3:.1f}ms ({written / elapsed:,.0f} rows/s)")
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
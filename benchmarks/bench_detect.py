@@ -0,0 +1,81 @@
+# Пропускная способность детектора всплесков (outages.detect) на синтетических рядах
+# за несколько лет: суточная сезонность, шум и вставленные всплески известной высоты.
+# Заодно считается, сколько вставленных всплесков найдено и сколько лишних срабатываний.
+# Запуск из корня репозитория: python -m benchmarks.bench_detect [лет] [сервисов]
+import sys
+import time
+
+import numpy as np
+
+import outages
+
+STEPS_PER_DAY = 24 * 3600 // outages.STEP
+
+
+def synthesize(years, services, spikes_per_year=40, seed=42):
+    rng = np.random.default_rng(seed)
+    steps = int(years * 365 * STEPS_PER_DAY)
+    t = np.arange(steps)
+    base = rng.uniform(5, 60, size=(services, 1))
+    daily = 0.4 * base * np.sin(2 * np.pi * t / STEPS_PER_DAY - 1.5)
+    matrix = rng.poisson(np.maximum(base + daily, 0.5)).astype(np.float64)
+
+    injected = []
+    for row in range(services):
+        starts = rng.choice(np.arange(outages.WINDOW, steps - 8), size=int(spikes_per_year * years), replace=False)
+        for start in np.sort(starts):
+            height = rng.uniform(10, 40) * base[row, 0] + outages.MIN_COUNT
+            width = rng.integers(2, 8)
+            matrix[row, start:start + width] += height
+            injected.append((row, int(start)))
+    # Пропуски в данных: бот или сервис съемки не работали
+    gaps = rng.random(matrix.shape) < 0.02
+    matrix[gaps] = np.nan
+    return matrix, injected
+
+
+def score(flags, injected, tolerance=2):
+    onset = flags.copy()
+    onset[:, 1:] &= ~flags[:, :-1]
+    found = {(int(r), int(c)) for r, c in zip(*np.nonzero(onset))}
+    hits = 0
+    matched = set()
+    for row, start in injected:
+        for c in range(start - tolerance, start + tolerance + 1):
+            if (row, c) in found:
+                hits += 1
+                matched.add((row, c))
+                break
+    return hits, len(found - matched)
+
+
+def main():
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    services = int(sys.argv[2]) if len(sys.argv) > 2 else len(outages.graphs.APPS)
+
+    start = time.perf_counter()
+    matrix, injected = synthesize(years, services)
+    print(f"synthesize {services} x {matrix.shape[1]:,} steps ({years:g} years): {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    scores, baseline, flags = outages.detect(matrix)
+    elapsed = time.perf_counter() - start
+    points = matrix.size
+    print(f"detect: {elapsed:.2f}s, {points / elapsed:,.0f} points/s "
+          f"(window {outages.WINDOW}, chunk {outages.CHUNK})")
+
+    hits, false_alarms = score(flags, injected)
+    print(f"injected spikes found: {hits}/{len(injected)}, other alarms: {false_alarms}")
+
+    # Полный путь монитора: сырые точки (service, ts, count) -> сетка -> всплески
+    names = [f"s{i}" for i in range(services)]
+    rows, cols = np.nonzero(~np.isnan(matrix))
+    samples = list(zip((names[r] for r in rows), (cols * outages.STEP).tolist(), matrix[rows, cols].astype(int).tolist()))
+    start = time.perf_counter()
+    spikes = outages.detect_samples(samples, names)
+    elapsed = time.perf_counter() - start
+    print(f"detect_samples from {len(samples):,} raw rows: {elapsed:.2f}s, {len(spikes)} spikes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Сравнение задержки доставки обновлений: long polling против webhook.
+# Фейковый отправитель кладет N обновлений и меряет время до запуска обработчика
+# (а для webhook — еще и время подтверждения HTTP-запроса).
+# Запуск из корня репозитория: python -m benchmarks.bench_ingest [N]
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession
+
+import webhook
+from benchmarks.fake_telegram import BOT_TOKEN, FakeTelegram, make_message_update
+
+SECRET = "bench-secret"
+PATH = "/webhook"
+
+
+def summary(samples):
+    ms = sorted(s * 1e3 for s in samples)
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.mean(ms), 3),
+        "p50_ms": round(ms[len(ms) // 2], 3),
+        "p99_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.99))], 3),
+    }
+
+
+def make_dispatcher(sent_at, latencies, done, n):
+    dp = Dispatcher()
+
+    async def on_message(message):
+        latencies.append(time.perf_counter() - sent_at[message.message_id])
+        if len(latencies) == n:
+            done.set()
+
+    dp.message.register(on_message)
+    return dp
+
+
+async def bench_polling(n, interval):
+    fake = FakeTelegram()
+    base = await fake.start()
+    bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    dp = make_dispatcher(sent_at, latencies, done, n)
+
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    await asyncio.sleep(0.5)
+    for i in range(1, n + 1):
+        sent_at[i] = time.perf_counter()
+        fake.push_update(make_message_update(i, 100 + i % 50, "/ping"))
+        await asyncio.sleep(interval)
+    await asyncio.wait_for(done.wait(), 60)
+
+    await dp.stop_polling()
+    await polling
+    await bot.session.close()
+    await fake.stop()
+    return {"delivery": summary(latencies)}
+
+
+async def bench_webhook(n, interval):
+    bot = Bot(BOT_TOKEN)
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    dp = make_dispatcher(sent_at, latencies, done, n)
+    app = webhook.build_app(dp, bot, PATH, SECRET)
+    runner = await webhook.start_server(app, "127.0.0.1", 0)
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}{PATH}"
+
+    acks = []
+    async with ClientSession() as http:
+        async def post(update):
+            start = time.perf_counter()
+            async with http.post(
+                url,
+                data=json.dumps(update),
+                headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": SECRET},
+            ) as resp:
+                await resp.read()
+                assert resp.status == 200, resp.status
+            acks.append(time.perf_counter() - start)
+
+        async with http.post(url, json={"update_id": 0}) as resp:
+            assert resp.status == 401, "запрос без секрета должен отклоняться"
+
+        posts = []
+        for i in range(1, n + 1):
+            sent_at[i] = time.perf_counter()
+            posts.append(asyncio.create_task(post(make_message_update(i, 100 + i % 50, "/ping"))))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*posts)
+        await asyncio.wait_for(done.wait(), 60)
+
+    await runner.cleanup()
+    return {"delivery": summary(latencies), "ack": summary(acks)}
+
+
+async def main(n, interval=0.005):
+    results = {
+        "updates": n,
+        "polling": await bench_polling(n, interval),
+        "webhook": await bench_webhook(n, interval),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,100 @@
+# Бенчмарк лидерборда рефералов на синтетической базе (по умолчанию 1M пользователей):
+# старый GROUP BY по users против инкрементальной таблицы referral_counts.
+# Запуск из корня репозитория: python -m benchmarks.bench_referrals [N]
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import db
+
+PAGE_SIZE = 10
+
+
+def populate(path, n):
+    random.seed(42)
+    # Степенное распределение: немногие приглашают многих
+    referrers = [random.randint(1, n) for _ in range(n // 50)]
+    with sqlite3.connect(path) as conn:
+        start = time.perf_counter()
+        conn.executemany(
+            "INSERT INTO users (user_id, name, referral_id) VALUES (?, ?, ?)",
+            (
+                (u, f"user {u}", random.choice(referrers) if random.random() < 0.3 else None)
+                for u in range(1, n + 1)
+            ),
+        )
+        elapsed = time.perf_counter() - start
+    print(f"insert {n} users with triggers: {elapsed:.1f}s ({n / elapsed:,.0f} rows/s)")
+
+
+def timed(label, func, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    print(f"{label:<40} {(time.perf_counter() - start) / repeat * 1e3:9.3f} ms")
+    return result
+
+
+async def timed_async(label, func, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = await func()
+    print(f"{label:<40} {(time.perf_counter() - start) / repeat * 1e3:9.3f} ms")
+    return result
+
+
+async def main(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.sqlite3")
+        await db.init_db()
+        populate(db.DB_PATH, n)
+
+        with sqlite3.connect(db.DB_PATH) as conn:
+            timed(
+                "old GROUP BY top-20",
+                lambda: conn.execute(
+                    "SELECT referral_id, COUNT(*) c FROM users WHERE referral_id IS NOT NULL "
+                    "GROUP BY referral_id ORDER BY c DESC LIMIT 20"
+                ).fetchall(),
+                repeat=3,
+            )
+
+        await timed_async("first page", lambda: db.get_referrers_page(PAGE_SIZE + 1))
+
+        # Проходим лидерборд вглубь и меряем последнюю страницу
+        total = await db.get_referrer_total()
+        cursor, pages, middle = None, 0, None
+        start = time.perf_counter()
+        while True:
+            rows = await db.get_referrers_page(PAGE_SIZE, cursor)
+            if not rows:
+                break
+            cursor = (rows[-1]["count"], rows[-1]["user_id"])
+            pages += 1
+            if pages == total // PAGE_SIZE // 2:
+                middle = rows[0]["user_id"]
+        elapsed = time.perf_counter() - start
+        print(f"walked {pages} pages ({total} referrers): {elapsed / pages * 1e3:.3f} ms/page")
+
+        deep = await timed_async("page at deepest cursor", lambda: db.get_referrers_page(PAGE_SIZE, cursor))
+        assert deep == []
+
+        rank = await timed_async("rank lookup", lambda: db.get_referral_rank(middle), repeat=200)
+        with sqlite3.connect(db.DB_PATH) as conn:
+            expected = timed(
+                "rank via COUNT(*) over referral_counts",
+                lambda: conn.execute(
+                    "SELECT COUNT(*) + 1 FROM referral_counts WHERE count > ?", (rank["count"],)
+                ).fetchone()[0],
+            )
+        assert rank["rank"] == expected, (rank, expected)
+        print(f"rank of {middle}: {rank}")
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000))
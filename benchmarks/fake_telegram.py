@@ -0,0 +1,151 @@
+# Локальная замена Telegram Bot API для бенчмарков: отдает обновления через getUpdates,
+# отвечает на методы отправки правдоподобными объектами и умеет имитировать
+# задержку сети, flood control (429 с retry_after) и заблокировавших бота пользователей (403).
+import asyncio
+import itertools
+import random
+import time
+
+from aiohttp import web
+
+BOT_ID = 1000
+BOT_TOKEN = f"{BOT_ID}:fake-token-for-benchmarks"
+
+SEND_METHODS = {"sendMessage", "copyMessage", "sendPhoto", "sendDocument", "sendVideo"}
+
+
+def make_user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def make_message_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": make_user(user_id),
+            "text": text,
+        },
+    }
+
+
+def make_callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1, blocked=()):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.blocked = set(blocked)
+        self.updates = asyncio.Queue()
+        self.calls = {}
+        self.errors = {429: 0, 403: 0}
+        self._message_ids = itertools.count(1)
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self._dispatch)
+        self._runner = None
+        self.base_url = None
+
+    def push_update(self, update):
+        self.updates.put_nowait(update)
+
+    async def _get_updates(self, payload):
+        timeout = float(payload.get("timeout") or 0)
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+        except asyncio.TimeoutError:
+            return []
+        limit = int(payload.get("limit") or 100)
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    def _message(self, chat_id, **extra):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"},
+            **extra,
+        }
+
+    def _error(self, code, description, **parameters):
+        self.errors[code] += 1
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    async def handle(self, method, payload):
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getUpdates":
+            return await self._get_updates(payload)
+
+        if method in SEND_METHODS:
+            chat_id = int(payload.get("chat_id", 0))
+            if chat_id in self.blocked:
+                return self._error(403, "Forbidden: bot was blocked by the user")
+            if self.flood_rate and random.random() < self.flood_rate:
+                return self._error(
+                    429, f"Too Many Requests: retry after {self.retry_after}", retry_after=self.retry_after
+                )
+            if method == "copyMessage":
+                return {"message_id": next(self._message_ids)}
+            if method == "sendPhoto":
+                file_id = f"photo-{next(self._message_ids)}"
+                photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 900, "height": 500}]
+                return self._message(chat_id, photo=photo)
+            return self._message(chat_id, text=payload.get("text", ""))
+        if method == "editMessageText":
+            return self._message(payload.get("chat_id") or 0, text=payload.get("text", ""))
+        return True
+
+    async def _read_payload(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    async def _dispatch(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        payload = await self._read_payload(request)
+        if method != "getUpdates" and (self.latency or self.jitter):
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        result = await self.handle(method, payload)
+        if isinstance(result, web.Response):
+            return result
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,466 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Общий лимит Bot API ~30 сообщений в секунду на бота
+GLOBAL_RATE = 30
+MAX_CONCURRENCY = 20
+MAX_RETRIES = 3
+PROGRESS_INTERVAL = 3.0
+# Статусы доставки: retry — временная ошибка, получатель будет повторен
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)
+# Аренда задания: без записи прогресса дольше LEASE секунд задание считается брошенным
+# и его забирает другой процесс. Новые задания других процессов ищутся раз в POLL_INTERVAL.
+LEASE = 60
+POLL_INTERVAL = 15.0
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Ожидающие получают токены строго по очереди захвата блокировки
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        # Flood control в Telegram общий на бота: останавливаем всех отправителей
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        # Токены копятся только после паузы, иначе сразу за 429 ушла бы целая пачка
+        self._updated = self._paused_until
+
+
+@dataclass
+class BroadcastResult:
+    total: int = 0
+    success: int = 0
+    blocked: int = 0
+    errors: int = 0
+    retries: int = 0
+    # Сколько было обработано до перезапуска: не учитывается в скорости
+    initial_success: int = 0
+    initial_processed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float = None
+
+    @property
+    def processed(self):
+        return self.success + self.blocked + self.errors
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return (self.success - self.initial_success) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        done = self.processed - self.initial_processed
+        if done <= 0:
+            return None
+        return max(0, self.total - self.processed) * self.elapsed / done
+
+
+async def _iterate(chat_ids):
+    if hasattr(chat_ids, "__aiter__"):
+        async for chat_id in chat_ids:
+            yield chat_id
+    else:
+        for chat_id in chat_ids:
+            yield chat_id
+
+
+async def run_broadcast(
+    bot: Bot,
+    chat_ids,
+    from_chat_id,
+    message_id,
+    *,
+    total=0,
+    result=None,
+    on_progress=None,
+    on_blocked=None,
+    on_result=None,
+    rate=GLOBAL_RATE,
+    concurrency=MAX_CONCURRENCY,
+    max_retries=MAX_RETRIES,
+    progress_interval=PROGRESS_INTERVAL,
+):
+    if result is None:
+        result = BroadcastResult(total=total)
+    result.finished_at = None
+    bucket = TokenBucket(rate)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    def finish(chat_id, status, error=None):
+        if on_result:
+            on_result(chat_id, status, error)
+
+    async def send(chat_id):
+        for attempt in range(max_retries + 1):
+            await bucket.acquire()
+            try:
+                # copy_message работает с любым типом сообщения без повторной загрузки медиа
+                await bot.copy_message(chat_id, from_chat_id, message_id)
+                result.success += 1
+                finish(chat_id, "sent")
+                return
+            except TelegramRetryAfter as e:
+                result.retries += 1
+                logger.warning(f"Flood control при рассылке, пауза {e.retry_after} с")
+                bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                result.blocked += 1
+                finish(chat_id, "blocked")
+                if on_blocked:
+                    try:
+                        await on_blocked(chat_id)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки блокировки {chat_id}: {e}")
+                return
+            except TRANSIENT_ERRORS as e:
+                result.errors += 1
+                logger.warning(f"Временная ошибка при рассылке {chat_id}: {e}")
+                finish(chat_id, "retry", str(e))
+                return
+            except Exception as e:
+                result.errors += 1
+                logger.error(f"Ошибка при рассылке {chat_id}: {e}")
+                finish(chat_id, "failed", str(e))
+                return
+        result.errors += 1
+        logger.error(f"Не удалось доставить {chat_id}: превышено число повторов")
+        finish(chat_id, "retry", "flood control")
+
+    async def worker():
+        while True:
+            chat_id = await queue.get()
+            try:
+                if chat_id is None:
+                    return
+                await send(chat_id)
+            finally:
+                queue.task_done()
+
+    async def reporter():
+        last = -1
+        while True:
+            await asyncio.sleep(progress_interval)
+            if result.processed != last:
+                last = result.processed
+                try:
+                    await on_progress(result)
+                except Exception as e:
+                    logger.error(f"Ошибка обновления прогресса рассылки: {e}")
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    progress_task = asyncio.create_task(reporter()) if on_progress else None
+    try:
+        counted = 0
+        async for chat_id in _iterate(chat_ids):
+            counted += 1
+            await queue.put(chat_id)
+        result.total = max(result.total, counted)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        if progress_task:
+            progress_task.cancel()
+        result.finished_at = time.monotonic()
+
+    logger.info(
+        f"Рассылка завершена: {result.success}/{result.total} за {result.elapsed:.1f} с "
+        f"({result.rate:.1f} сообщ./с)"
+    )
+    return result
+
+
+class _DeliveryLog:
+    # Копит статусы получателей до пакетной записи и двигает курсор:
+    # курсор — наибольший user_id, до которого включительно все получатели обработаны
+    def __init__(self, job_id, cursor, batch_size):
+        self.job_id = job_id
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.tracking = True
+        self.full = asyncio.Event()
+        self._inflight = deque()
+        self._done = set()
+        self._rows = []
+
+    def dispatch(self, user_id):
+        self._inflight.append(user_id)
+
+    def record(self, user_id, status, error=None):
+        self._rows.append((self.job_id, user_id, status, error))
+        if self.tracking:
+            self._done.add(user_id)
+        if len(self._rows) >= self.batch_size:
+            self.full.set()
+
+    def take(self):
+        while self._inflight and self._inflight[0] in self._done:
+            self.cursor = self._inflight.popleft()
+            self._done.discard(self.cursor)
+        rows, self._rows = self._rows, []
+        return rows, self.cursor
+
+    def restore(self, rows):
+        # Пакет не записался: вернется в следующую запись вместе с новыми статусами
+        self._rows[:0] = rows
+
+
+class BroadcastWorker:
+    def __init__(
+        self,
+        bot: Bot,
+        *,
+        on_progress=None,
+        on_finish=None,
+        on_blocked=None,
+        batch_size=200,
+        flush_interval=2.0,
+        max_attempts=3,
+        retry_delay=10.0,
+        lease=LEASE,
+        poll_interval=POLL_INTERVAL,
+    ):
+        self.bot = bot
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+        self.on_blocked = on_blocked
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.current = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(
+        self, from_chat_id, message_id, service=None, created_by=None, status_chat_id=None, status_message_id=None
+    ):
+        # service — рассылка только подписчикам этого сервиса
+        job_id = await db.create_broadcast_job(
+            from_chat_id, message_id, service, created_by, status_chat_id, status_message_id
+        )
+        self._wakeup.set()
+        return job_id
+
+    async def _release(self, job):
+        try:
+            await db.release_broadcast_job(job["id"], self.owner)
+        except db.DBError:
+            pass
+
+    async def _loop(self):
+        # Задания захватываются по одному; брошенные упавшим процессом (аренда истекла)
+        # подхватываются с курсора
+        while True:
+            job = None
+            try:
+                self._wakeup.clear()
+                job = await db.claim_broadcast_job(self.owner, self.lease)
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                if job is not None:
+                    await self._release(job)
+                raise
+            except (db.DBError, *TRANSIENT_ERRORS) as e:
+                # Временный сбой (база занята, сеть): задание остается running и будет продолжено
+                logger.warning(f"Рассылка прервана временной ошибкой, повтор через {self.retry_delay} с: {e}")
+                if job is not None:
+                    await self._release(job)
+                await asyncio.sleep(self.retry_delay)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике рассылок: {e}", exc_info=True)
+                if job is not None:
+                    try:
+                        await db.finish_broadcast_job(job["id"], self.owner, "failed")
+                    except Exception:
+                        pass
+                await asyncio.sleep(self.retry_delay)
+            finally:
+                self.current = None
+
+    async def _run_job(self, job):
+        job_id = job["id"]
+        if job["started_at"] is None:
+            if job["service"]:
+                job["total"] = await db.get_subscriber_count(job["service"])
+            else:
+                job["total"] = (await db.get_user_counts())["active"]
+            await db.start_broadcast_job(job_id, job["total"])
+        else:
+            logger.info(f"Возобновление рассылки #{job_id} после user_id {job['cursor']}")
+
+        processed = job["sent"] + job["blocked"] + job["failed"]
+        result = BroadcastResult(
+            total=job["total"],
+            success=job["sent"],
+            blocked=job["blocked"],
+            errors=job["failed"],
+            initial_success=job["sent"],
+            initial_processed=processed,
+        )
+        log = _DeliveryLog(job_id, job["cursor"], self.batch_size)
+        self.current = (job, result)
+        lost = False
+
+        async def flush():
+            # Запись прогресса заодно продлевает аренду задания
+            nonlocal lost
+            rows, cursor = log.take()
+            try:
+                owned = await db.record_broadcast_progress(
+                    job_id, self.owner, rows, cursor, result.success, result.blocked, result.errors
+                )
+            except Exception:
+                log.restore(rows)
+                raise
+            if not owned and not lost:
+                lost = True
+                logger.warning(f"Рассылку #{job_id} перехватил другой процесс, отправка остановлена")
+
+        async def flusher():
+            while True:
+                try:
+                    await asyncio.wait_for(log.full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                log.full.clear()
+                try:
+                    await flush()
+                except Exception as e:
+                    logger.error(f"Не удалось записать прогресс рассылки #{job_id}: {e}")
+
+        async def on_progress(res):
+            if self.on_progress:
+                await self.on_progress(job, res)
+
+        # Получатели за курсором, уже записанные до перезапуска, пропускаются
+        delivered = await db.get_delivered_after(job_id, job["cursor"])
+
+        if job["service"]:
+            audience = db.iter_subscribers(job["service"], after_id=job["cursor"])
+        else:
+            audience = db.iter_active_users(after_id=job["cursor"])
+
+        async def recipients():
+            async for user_id in audience:
+                if lost:
+                    return
+                if user_id in delivered:
+                    continue
+                log.dispatch(user_id)
+                yield user_id
+
+        flush_task = asyncio.create_task(flusher())
+        try:
+            await run_broadcast(
+                self.bot,
+                recipients(),
+                job["from_chat_id"],
+                job["message_id"],
+                total=job["total"],
+                result=result,
+                on_progress=on_progress,
+                on_blocked=self.on_blocked,
+                on_result=log.record,
+            )
+            await flush()
+
+            # Повторы временных ошибок с нарастающей паузой; курсор при этом не двигается
+            log.tracking = False
+            for attempt in range(1, self.max_attempts):
+                if lost:
+                    break
+                retry_ids = await db.get_retryable_deliveries(job_id, self.max_attempts)
+                if not retry_ids:
+                    break
+                await asyncio.sleep(self.retry_delay * attempt)
+                result.errors -= len(retry_ids)
+                await run_broadcast(
+                    self.bot,
+                    retry_ids,
+                    job["from_chat_id"],
+                    job["message_id"],
+                    total=job["total"],
+                    result=result,
+                    on_blocked=self.on_blocked,
+                    on_result=log.record,
+                )
+                await flush()
+        finally:
+            flush_task.cancel()
+            # При остановке сохраняем то, что успели, чтобы не разослать повторно
+            await flush()
+
+        if lost:
+            return
+        result.finished_at = time.monotonic()
+        await db.finish_broadcast_job(job_id, self.owner, "done")
+        if self.on_finish:
+            await self.on_finish(job, result)
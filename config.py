@@ -1,3 +1,4 @@
+import hashlib
 import os
 from dotenv import load_dotenv
 
@@ -24,3 +25,50 @@ WELCOME_TEXT = (
     "👇Выберите пункт меню ниже:"
 )
 
+# Ограничение частоты запросов на пользователя (GCRA)
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", "1"))
+RATE_BURST = int(os.getenv("RATE_BURST", "5"))
+# Стоимость дорогих команд и callback_data; ключ с "_" на конце — префикс
+RATE_COSTS = {
+    "/refstats": 3,
+    "refstats_": 3,
+    "/graph": 2,
+    "graph_": 2,
+    "admin_logs": 5,
+    "admin_errors": 2,
+    "/errors": 2,
+}
+
+TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
+LAST_FEED_LIMIT = int(os.getenv("LAST_FEED_LIMIT", "5"))
+
+# Получение обновлений: polling или webhook
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Одинаковый секрет на всех репликах: по умолчанию выводится из токена
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))
+# Отдельный сервер /metrics (порт 0 — не запускать). На публичный порт webhook метрики
+# не выводятся; по умолчанию сервер слушает только localhost, а если его открывают
+# наружу, стоит задать METRICS_TOKEN — тогда нужен заголовок Authorization: Bearer <токен>
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Планировщик обновлений: число воркеров и предел очереди, после которого обычные
+# обновления отклоняются ответом «попробуйте позже» (администраторы не отклоняются).
+# Очередь одного чата ограничена отдельно, чтобы один флудящий чат не занял всю очередь;
+# при остановке уже принятые обновления дорабатываются не дольше UPDATE_DRAIN_TIMEOUT секунд
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_CHAT_QUEUE_SIZE = int(os.getenv("UPDATE_CHAT_QUEUE_SIZE", "10"))
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "10"))
+
+# Время жизни незавершенного диалога FSM, секунды
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "3600"))
+
+# Сводки для администраторов: раз в DIGEST_INTERVAL секунд, не больше DIGEST_MAX_ITEMS строк в топе
+DIGEST_INTERVAL = int(os.getenv("DIGEST_INTERVAL", "60"))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "10"))
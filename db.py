@@ -1,44 +1,966 @@
-import sqlite3
-from datetime import datetime
+import asyncio
 import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from cache import LRUCache, SortedIdSet
 
 logger = logging.getLogger(__name__)
 DB_PATH = "database.sqlite3"
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "init_db.sql")
+
+# Одно долгоживущее соединение, с которым работает только выделенный поток БД.
+# Все запросы выполняются в нём последовательно и не блокируют event loop.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+_conn = None
+
+# Кэш профилей для /start и /me; инвалидируется явно при записи
+USER_CACHE_SIZE = 50000
+USER_CACHE_TTL = 600
+_user_cache = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# Ранг меняется и от чужих приглашений, поэтому TTL короче
+_referral_cache = LRUCache(maxsize=USER_CACHE_SIZE, ttl=30)
+# Подписчики по сервисам; загружаются в init_db и обновляются при каждой записи.
+# Подписки из других процессов сюда не попадают, поэтому кэш — только для отображения меню,
+# а решения (кому слать оповещение, включить или выключить подписку) принимаются по БД
+_subscribers = {}
+
+# Отложенная запись пользователей: add_user, update_user_name и block_user только копят
+# изменения, а фоновая задача пишет их одной транзакцией — по размеру пачки или по таймеру.
+# Чтения видят еще не записанные изменения. При падении процесса теряется не больше
+# WRITE_FLUSH_INTERVAL секунд записей; close_db сбрасывает очередь на диск.
+WRITE_BATCH_SIZE = 500
+WRITE_FLUSH_INTERVAL = 0.5
+# user_id -> {"insert": (name, referral_id, joined_at), "name": ..., "blocked": True}
+_pending_writes = {}
+# Пачка, которая пишется прямо сейчас; старше _pending_writes
+_flushing_writes = {}
+# Создаются при первой записи или в init_db (_ensure_write_state), сбрасываются в close_db
+_writes_pending = None
+_writes_full = None
+_flush_lock = None
+_writer_task = None
 
 class DBError(Exception):
     pass
 
-def init_db():
+def _connect():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = _connect()
+    return _conn
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
     try:
-        with open("init_db.sql", "r", encoding="utf-8") as f:
-            sql = f.read()
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.executescript(sql)
+        return await loop.run_in_executor(_executor, func, *args)
+    finally:
+        # Время включает ожидание в очереди потока БД — именно его видит хэндлер
+        metrics.observe_db(func.__name__.lstrip("_"), time.perf_counter() - start)
+
+def _migrate(conn):
+    # Старая таблица messages хранила время свободным текстом в колонке time
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+    if columns and "ts" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE messages ADD COLUMN ts INTEGER NOT NULL DEFAULT 0")
+            conn.execute("ALTER TABLE messages ADD COLUMN service TEXT")
+            conn.execute(
+                "UPDATE messages SET ts = COALESCE(CAST(strftime('%s', time) AS INTEGER), 0)"
+            )
+        logger.info("Таблица messages переведена на числовые метки времени")
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(broadcast_jobs)")}
+    if columns and "service" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE broadcast_jobs ADD COLUMN service TEXT")
+    if columns and "owner" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE broadcast_jobs ADD COLUMN owner TEXT")
+            conn.execute("ALTER TABLE broadcast_jobs ADD COLUMN heartbeat INTEGER")
+
+def _init_db():
+    with open(SCHEMA_PATH, "r", encoding="utf-8") as f:
+        sql = f.read()
+    conn = _get_conn()
+    _migrate(conn)
+    conn.executescript(sql)
+    conn.commit()
+    return _load_subscribers()
+
+def _close_db():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+async def init_db():
+    global _writer_task
+    try:
+        subscribers = await _run(_init_db)
     except Exception as e:
         logger.error(f"Ошибка инициализации БД: {e}")
         raise DBError("Не удалось инициализировать базу данных")
+    _subscribers.clear()
+    _subscribers.update(subscribers)
+    if _writer_task is None:
+        _ensure_write_state()
+        if _pending_writes:
+            _writes_pending.set()
+        _writer_task = asyncio.create_task(_writer())
+
+def _ensure_write_state():
+    global _writes_pending, _writes_full, _flush_lock
+    if _writes_pending is None:
+        _writes_pending, _writes_full, _flush_lock = asyncio.Event(), asyncio.Event(), asyncio.Lock()
+
+async def close_db():
+    global _writer_task, _writes_pending, _writes_full, _flush_lock
+    if _writer_task is not None:
+        _writer_task.cancel()
+        try:
+            await _writer_task
+        except asyncio.CancelledError:
+            pass
+        _writer_task = None
+    try:
+        await flush_writes()
+    except DBError:
+        logger.error(f"При остановке не записаны изменения {len(_pending_writes)} пользователей")
+    # Следующий init_db может работать уже в другом event loop
+    _writes_pending = _writes_full = _flush_lock = None
+    try:
+        await _run(_close_db)
+    except Exception as e:
+        logger.error(f"Ошибка закрытия БД: {e}")
+
+# Пользователи
+def _write_users(inserts, names, blocks):
+    # Порядок внутри пачки: сначала новые пользователи, затем имена, затем блокировки
+    conn = _get_conn()
+    with conn:
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO users (user_id, name, referral_id, joined_at, is_blocked)
+            VALUES (?, ?, ?, ?, 0)
+            """,
+            inserts,
+        )
+        conn.executemany("UPDATE users SET name = ? WHERE user_id = ?", names)
+        conn.executemany("UPDATE users SET is_blocked = 1 WHERE user_id = ?", blocks)
+        conn.executemany("DELETE FROM subscriptions WHERE user_id = ?", blocks)
+
+def _get_user(user_id):
+    row = _get_conn().execute(
+        "SELECT user_id, name, referral_id, joined_at, is_blocked FROM users WHERE user_id = ?",
+        (user_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+def _get_recent_users(limit):
+    rows = _get_conn().execute(
+        "SELECT user_id, name, referral_id, joined_at, is_blocked FROM users ORDER BY joined_at DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def _get_all_users():
+    rows = _get_conn().execute(
+        "SELECT user_id, name, referral_id, joined_at, is_blocked FROM users"
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def _get_active_user_ids(after_id, limit):
+    rows = _get_conn().execute(
+        "SELECT user_id FROM users WHERE is_blocked = 0 AND user_id > ? ORDER BY user_id LIMIT ?",
+        (after_id, limit),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def _get_user_counts():
+    row = _get_conn().execute(
+        "SELECT total, blocked FROM user_counters WHERE id = 1"
+    ).fetchone()
+    total, blocked = (row[0], row[1]) if row else (0, 0)
+    return {"total": total, "active": total - blocked, "blocked": blocked}
+
+def _queue_write(user_id):
+    # Запись до init_db не падает: событие и блокировка создаются при первой записи
+    _ensure_write_state()
+    entry = _pending_writes.get(user_id)
+    if entry is None:
+        entry = _pending_writes[user_id] = {}
+        if len(_pending_writes) >= WRITE_BATCH_SIZE:
+            _writes_full.set()
+    _writes_pending.set()
+    _user_cache.invalidate(user_id)
+    return entry
+
+def _has_pending_writes(user_id):
+    return user_id in _pending_writes or user_id in _flushing_writes
+
+def _overlay(user_id, user):
+    # Поверх строки из БД накладываются изменения, еще не записанные на диск
+    for writes in (_flushing_writes, _pending_writes):
+        entry = writes.get(user_id)
+        if not entry:
+            continue
+        if user is None and "insert" in entry:
+            name, referral_id, joined_at = entry["insert"]
+            user = {
+                "user_id": user_id,
+                "name": name,
+                "referral_id": referral_id,
+                "joined_at": joined_at,
+                "is_blocked": 0,
+            }
+        if user is None:
+            continue
+        if "name" in entry:
+            user["name"] = entry["name"]
+        if entry.get("blocked"):
+            user["is_blocked"] = 1
+    return user
+
+async def flush_writes():
+    if _flush_lock is None:
+        return 0
+    async with _flush_lock:
+        if not _pending_writes:
+            return 0
+        _flushing_writes.update(_pending_writes)
+        _pending_writes.clear()
+        _writes_pending.clear()
+        _writes_full.clear()
+        batch = _flushing_writes
+        inserts = [(user_id, *entry["insert"]) for user_id, entry in batch.items() if "insert" in entry]
+        names = [(entry["name"], user_id) for user_id, entry in batch.items() if "name" in entry]
+        blocks = [(user_id,) for user_id, entry in batch.items() if entry.get("blocked")]
+        try:
+            await _run(_write_users, inserts, names, blocks)
+        except Exception as e:
+            logger.error(f"Ошибка записи пачки пользователей ({len(batch)}): {e}")
+            # Пачка возвращается в очередь, более новые изменения остаются поверх
+            for user_id, entry in batch.items():
+                _pending_writes[user_id] = {**entry, **_pending_writes.get(user_id, {})}
+            _writes_pending.set()
+            raise DBError("Не удалось записать пользователей")
+        finally:
+            # Кэш мог заполниться строками из БД до записи пачки
+            for user_id in batch:
+                _user_cache.invalidate(user_id)
+            for _, _, referral_id, _ in inserts:
+                if referral_id is not None:
+                    _referral_cache.invalidate(referral_id)
+            batch.clear()
+        return len(inserts) + len(names) + len(blocks)
+
+async def _writer():
+    while True:
+        await _writes_pending.wait()
+        try:
+            await asyncio.wait_for(_writes_full.wait(), WRITE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await flush_writes()
+        except DBError:
+            await asyncio.sleep(WRITE_FLUSH_INTERVAL)
+
+async def _sync_writes():
+    # Агрегатные чтения (счетчики, рефералы, обход пользователей) должны учитывать очередь.
+    # Если пачка не записалась, DBError уходит вызывающему: без нее результат был бы неполным
+    if _pending_writes or _flushing_writes:
+        await flush_writes()
+
+async def add_user(user_id, name=None, referral_id=None):
+    entry = _queue_write(user_id)
+    if "insert" not in entry:
+        entry["insert"] = (name, referral_id, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
+    if referral_id is not None:
+        _referral_cache.invalidate(referral_id)
+
+async def get_user(user_id):
+    user = _user_cache.get(user_id)
+    if user is None:
+        try:
+            user = await _run(_get_user, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения пользователя {user_id}: {e}")
+            raise DBError("Не удалось получить пользователя")
+        if user is not None and not _has_pending_writes(user_id):
+            _user_cache.set(user_id, user)
+    return _overlay(user_id, dict(user) if user is not None else None)
+
+async def warm_user_cache(limit=USER_CACHE_SIZE):
+    try:
+        users = await _run(_get_recent_users, limit)
+    except Exception as e:
+        logger.error(f"Ошибка прогрева кэша пользователей: {e}")
+        return 0
+    # Самые свежие пользователи попадают в конец LRU последними
+    for user in reversed(users):
+        _user_cache.set(user["user_id"], user)
+    logger.info(f"Кэш пользователей прогрет: {len(users)} записей")
+    return len(users)
+
+def cache_stats():
+    return {"users": _user_cache.stats(), "referrals": _referral_cache.stats()}
+
+async def get_all_users():
+    await _sync_writes()
+    try:
+        return await _run(_get_all_users)
+    except Exception as e:
+        logger.error(f"Ошибка получения пользователей: {e}")
+        raise DBError("Не удалось получить пользователей")
 
-def add_user(user_id, name=None, referral_id=None):
+async def iter_active_users(chunk_size=500, after_id=0):
+    # Keyset-пагинация по user_id: память не растет с числом пользователей
+    await _sync_writes()
+    while True:
+        try:
+            chunk = await _run(_get_active_user_ids, after_id, chunk_size)
+        except Exception as e:
+            logger.error(f"Ошибка получения пользователей после {after_id}: {e}")
+            raise DBError("Не удалось получить пользователей")
+        for user_id in chunk:
+            yield user_id
+        if len(chunk) < chunk_size:
+            return
+        after_id = chunk[-1]
+
+async def get_user_counts():
+    await _sync_writes()
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        return await _run(_get_user_counts)
+    except Exception as e:
+        logger.error(f"Ошибка подсчета пользователей: {e}")
+        raise DBError("Не удалось получить число пользователей")
+
+async def update_user_name(user_id, name):
+    _queue_write(user_id)["name"] = name
+
+async def block_user(user_id):
+    _queue_write(user_id)["blocked"] = True
+    for subscribers in _subscribers.values():
+        subscribers.discard(user_id)
+
+# Подписки
+def _load_subscribers():
+    by_service = {}
+    for service, user_id in _get_conn().execute(
+        "SELECT service, user_id FROM subscriptions ORDER BY service, user_id"
+    ):
+        by_service.setdefault(service, []).append(user_id)
+    return {service: SortedIdSet(ids) for service, ids in by_service.items()}
+
+def _set_subscription(user_id, service, enabled):
+    conn = _get_conn()
+    with conn:
+        if enabled:
             conn.execute(
-                """
-                INSERT OR IGNORE INTO users (user_id, name, referral_id, is_blocked)
-                VALUES (?, ?, ?, 0)
-                """,
-                (user_id, name, referral_id),
+                "INSERT OR IGNORE INTO subscriptions (service, user_id) VALUES (?, ?)", (service, user_id)
             )
+        else:
+            conn.execute("DELETE FROM subscriptions WHERE service = ? AND user_id = ?", (service, user_id))
+
+def _is_subscribed(user_id, service):
+    row = _get_conn().execute(
+        "SELECT 1 FROM subscriptions WHERE service = ? AND user_id = ?", (service, user_id)
+    ).fetchone()
+    return row is not None
+
+def _get_subscriber_count(service):
+    return _get_conn().execute("SELECT COUNT(*) FROM subscriptions WHERE service = ?", (service,)).fetchone()[0]
+
+def _get_subscriber_ids(service, after_id, limit):
+    rows = _get_conn().execute(
+        "SELECT user_id FROM subscriptions WHERE service = ? AND user_id > ? ORDER BY user_id LIMIT ?",
+        (service, after_id, limit),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+async def set_subscription(user_id, service, enabled):
+    try:
+        await _run(_set_subscription, user_id, service, enabled)
     except Exception as e:
-        logger.error(f"Ошибка добавления пользователя {user_id}: {e}")
-        raise DBError("Не удалось добавить пользователя")
+        logger.error(f"Ошибка изменения подписки {user_id} на {service}: {e}")
+        raise DBError("Не удалось изменить подписку")
+    subscribers = _subscribers.setdefault(service, SortedIdSet())
+    if enabled:
+        subscribers.add(user_id)
+    else:
+        subscribers.discard(user_id)
 
-def get_last_messages(limit=5):
+def get_subscriptions(user_id):
+    return {service for service, subscribers in _subscribers.items() if user_id in subscribers}
+
+async def is_subscribed(user_id, service):
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            rows = conn.execute(
-                "SELECT time, text FROM messages ORDER BY time DESC LIMIT ?", (limit,)
-            ).fetchall()
-            return [{"time": row[0], "text": row[1]} for row in rows]
+        subscribed = await _run(_is_subscribed, user_id, service)
+    except Exception as e:
+        logger.error(f"Ошибка проверки подписки {user_id} на {service}: {e}")
+        raise DBError("Не удалось проверить подписку")
+    # Подписка могла измениться в другом процессе: кэш меню догоняет БД
+    subscribers = _subscribers.setdefault(service, SortedIdSet())
+    if subscribed:
+        subscribers.add(user_id)
+    else:
+        subscribers.discard(user_id)
+    return subscribed
+
+async def get_subscriber_count(service):
+    try:
+        return await _run(_get_subscriber_count, service)
+    except Exception as e:
+        logger.error(f"Ошибка подсчета подписчиков {service}: {e}")
+        raise DBError("Не удалось получить число подписчиков")
+
+async def iter_subscribers(service, chunk_size=500, after_id=0):
+    # Обход диапазона первичного ключа (service, user_id): O(подписчиков), курсор как у iter_active_users
+    while True:
+        try:
+            chunk = await _run(_get_subscriber_ids, service, after_id, chunk_size)
+        except Exception as e:
+            logger.error(f"Ошибка получения подписчиков {service} после {after_id}: {e}")
+            raise DBError("Не удалось получить подписчиков")
+        for user_id in chunk:
+            yield user_id
+        if len(chunk) < chunk_size:
+            return
+        after_id = chunk[-1]
+
+# Рефералы
+_MISSING = object()
+_REFERRER_COLUMNS = "r.user_id AS user_id, u.name AS name, r.count AS count"
+
+def _get_referrers_page(limit, cursor, backward):
+    conn = _get_conn()
+    # Порядок лидерборда: count DESC, user_id DESC — обход индекса (count, user_id) с конца
+    if cursor is None:
+        rows = conn.execute(
+            f"""
+            SELECT {_REFERRER_COLUMNS} FROM referral_counts r
+            LEFT JOIN users u ON u.user_id = r.user_id
+            ORDER BY r.count DESC, r.user_id DESC
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+    elif backward:
+        rows = conn.execute(
+            f"""
+            SELECT {_REFERRER_COLUMNS} FROM referral_counts r
+            LEFT JOIN users u ON u.user_id = r.user_id
+            WHERE (r.count, r.user_id) > (?, ?)
+            ORDER BY r.count, r.user_id
+            LIMIT ?
+            """,
+            (cursor[0], cursor[1], limit),
+        ).fetchall()
+        rows.reverse()
+    else:
+        rows = conn.execute(
+            f"""
+            SELECT {_REFERRER_COLUMNS} FROM referral_counts r
+            LEFT JOIN users u ON u.user_id = r.user_id
+            WHERE (r.count, r.user_id) < (?, ?)
+            ORDER BY r.count DESC, r.user_id DESC
+            LIMIT ?
+            """,
+            (cursor[0], cursor[1], limit),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+def _get_referrer_total():
+    row = _get_conn().execute("SELECT COALESCE(SUM(referrers), 0) FROM referral_count_hist").fetchone()
+    return row[0]
+
+def _get_referral_count(user_id):
+    row = _get_conn().execute(
+        "SELECT count FROM referral_counts WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+def _get_referral_rank(user_id):
+    conn = _get_conn()
+    row = conn.execute("SELECT count FROM referral_counts WHERE user_id = ?", (user_id,)).fetchone()
+    if not row:
+        return None
+    # Ранг = 1 + число рефереров с большим count; суммируются только различные значения count
+    ahead = conn.execute(
+        "SELECT COALESCE(SUM(referrers), 0) FROM referral_count_hist WHERE count > ?", (row[0],)
+    ).fetchone()[0]
+    return {"count": row[0], "rank": ahead + 1}
+
+async def get_top_referrers(limit=10):
+    return await get_referrers_page(limit)
+
+async def get_referrers_page(limit=10, cursor=None, backward=False):
+    await _sync_writes()
+    try:
+        return await _run(_get_referrers_page, limit, cursor, backward)
+    except Exception as e:
+        logger.error(f"Ошибка получения топа рефералов: {e}")
+        raise DBError("Не удалось получить топ рефералов")
+
+async def get_referrer_total():
+    await _sync_writes()
+    try:
+        return await _run(_get_referrer_total)
+    except Exception as e:
+        logger.error(f"Ошибка подсчета рефереров: {e}")
+        raise DBError("Не удалось получить число рефереров")
+
+async def get_referral_count(user_id):
+    await _sync_writes()
+    try:
+        return await _run(_get_referral_count, user_id)
+    except Exception as e:
+        logger.error(f"Ошибка подсчета рефералов {user_id}: {e}")
+        raise DBError("Не удалось получить число рефералов")
+
+async def get_referral_rank(user_id):
+    cached = _referral_cache.get(user_id, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    await _sync_writes()
+    try:
+        rank = await _run(_get_referral_rank, user_id)
+    except Exception as e:
+        logger.error(f"Ошибка получения ранга {user_id}: {e}")
+        raise DBError("Не удалось получить место в рейтинге")
+    _referral_cache.set(user_id, rank)
+    return rank
+
+# Инциденты
+# Версия ленты — MAX(id) инцидентов: по ней main.py сбрасывает готовую ленту /last.
+# Инциденты добавляют и другие процессы, поэтому версия перечитывается из БД,
+# но не чаще раза в INCIDENTS_PROBE_INTERVAL секунд; своя вставка сбрасывает ожидание
+INCIDENTS_PROBE_INTERVAL = 5
+_incidents_version = None
+_incidents_checked_at = None
+
+def _add_incident(text, service, ts):
+    conn = _get_conn()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO messages (ts, service, text) VALUES (?, ?, ?)", (ts, service, text)
+        )
+    return cur.lastrowid
+
+def _get_incidents_version():
+    return _get_conn().execute("SELECT MAX(id) FROM messages").fetchone()[0]
+
+def _get_last_messages(limit, service):
+    conn = _get_conn()
+    if service is None:
+        rows = conn.execute(
+            "SELECT ts, service, text FROM messages ORDER BY ts DESC LIMIT ?", (limit,)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT ts, service, text FROM messages WHERE service = ? ORDER BY ts DESC LIMIT ?",
+            (service, limit),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+async def add_incident(text, service=None, ts=None):
+    global _incidents_checked_at
+    ts = int(time.time()) if ts is None else int(ts)
+    try:
+        incident_id = await _run(_add_incident, text, service, ts)
+    except Exception as e:
+        logger.error(f"Ошибка добавления инцидента: {e}")
+        raise DBError("Не удалось добавить инцидент")
+    _incidents_checked_at = None
+    return incident_id
+
+async def incidents_version():
+    global _incidents_version, _incidents_checked_at
+    now = time.monotonic()
+    if _incidents_checked_at is None or now - _incidents_checked_at >= INCIDENTS_PROBE_INTERVAL:
+        try:
+            _incidents_version = await _run(_get_incidents_version)
+        except Exception as e:
+            logger.error(f"Ошибка проверки версии инцидентов: {e}")
+            raise DBError("Не удалось проверить инциденты")
+        _incidents_checked_at = now
+    return _incidents_version
+
+async def get_last_messages(limit=5, service=None):
+    try:
+        return await _run(_get_last_messages, limit, service)
     except Exception as e:
         logger.error(f"Ошибка получения сообщений: {e}")
         raise DBError("Не удалось получить сообщения")
+
+def _get_last_incident_ts(service):
+    row = _get_conn().execute("SELECT MAX(ts) FROM messages WHERE service = ?", (service,)).fetchone()
+    return row[0]
+
+async def get_last_incident_ts(service):
+    try:
+        return await _run(_get_last_incident_ts, service)
+    except Exception as e:
+        logger.error(f"Ошибка получения времени инцидента: {e}")
+        raise DBError("Не удалось получить время инцидента")
+
+# Временные ряды жалоб
+def _add_outage_samples(rows):
+    conn = _get_conn()
+    with conn:
+        # Последние точки графика уточняются между съемками, поэтому значение перезаписывается
+        conn.executemany(
+            "INSERT INTO outage_samples (service, ts, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (service, ts) DO UPDATE SET count = excluded.count",
+            rows,
+        )
+    return len(rows)
+
+def _get_outage_samples(services, since):
+    conn = _get_conn()
+    rows = []
+    for service in services:
+        rows.extend(
+            conn.execute(
+                "SELECT service, ts, count FROM outage_samples WHERE service = ? AND ts >= ? ORDER BY ts",
+                (service, since),
+            ).fetchall()
+        )
+    return [tuple(row) for row in rows]
+
+async def add_outage_samples(rows):
+    try:
+        return await _run(_add_outage_samples, list(rows))
+    except Exception as e:
+        logger.error(f"Ошибка записи временного ряда: {e}")
+        raise DBError("Не удалось записать временной ряд")
+
+async def get_outage_samples(services, since=0):
+    try:
+        return await _run(_get_outage_samples, list(services), since)
+    except Exception as e:
+        logger.error(f"Ошибка чтения временного ряда: {e}")
+        raise DBError("Не удалось прочитать временной ряд")
+
+# Кэш file_id
+def _get_file_id(content_hash):
+    row = _get_conn().execute(
+        "SELECT file_id FROM media_cache WHERE content_hash = ?", (content_hash,)
+    ).fetchone()
+    return row[0] if row else None
+
+def _save_file_id(content_hash, source, file_id):
+    conn = _get_conn()
+    with conn:
+        # У источника актуален только последний файл: старые file_id удаляются
+        conn.execute(
+            "DELETE FROM media_cache WHERE source = ? AND content_hash != ?", (source, content_hash)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO media_cache (content_hash, source, file_id) VALUES (?, ?, ?)",
+            (content_hash, source, file_id),
+        )
+
+def _drop_file_id(content_hash):
+    conn = _get_conn()
+    with conn:
+        conn.execute("DELETE FROM media_cache WHERE content_hash = ?", (content_hash,))
+
+async def get_file_id(content_hash):
+    try:
+        return await _run(_get_file_id, content_hash)
+    except Exception as e:
+        logger.error(f"Ошибка получения file_id {content_hash}: {e}")
+        raise DBError("Не удалось получить file_id")
+
+async def save_file_id(content_hash, source, file_id):
+    try:
+        await _run(_save_file_id, content_hash, source, file_id)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения file_id {content_hash}: {e}")
+        raise DBError("Не удалось сохранить file_id")
+
+async def drop_file_id(content_hash):
+    try:
+        await _run(_drop_file_id, content_hash)
+    except Exception as e:
+        logger.error(f"Ошибка удаления file_id {content_hash}: {e}")
+        raise DBError("Не удалось удалить file_id")
+
+# Рассылки
+_JOB_COLUMNS = """
+    id, from_chat_id, message_id, service, status, cursor, total, sent, blocked, failed,
+    created_by, status_chat_id, status_message_id, created_at, started_at, finished_at, owner, heartbeat
+"""
+
+def _create_broadcast_job(from_chat_id, message_id, service, created_by, status_chat_id, status_message_id):
+    conn = _get_conn()
+    with conn:
+        cur = conn.execute(
+            """
+            INSERT INTO broadcast_jobs (from_chat_id, message_id, service, created_by, status_chat_id, status_message_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (from_chat_id, message_id, service, created_by, status_chat_id, status_message_id),
+        )
+    return cur.lastrowid
+
+def _claim_broadcast_job(owner, now, stale_before):
+    # Захват одним UPDATE: из нескольких процессов задание получит только один.
+    # Выполняющееся задание перехватывается, только если его аренда просрочена
+    # (владелец упал) или оно уже принадлежит этому обработчику.
+    conn = _get_conn()
+    with conn:
+        cur = conn.execute(
+            """
+            UPDATE broadcast_jobs SET status = 'running', owner = ?, heartbeat = ?
+            WHERE id = (
+                SELECT id FROM broadcast_jobs
+                WHERE status = 'pending'
+                   OR (status = 'running' AND (owner = ? OR heartbeat IS NULL OR heartbeat < ?))
+                ORDER BY id LIMIT 1
+            )
+            """,
+            (owner, now, owner, stale_before),
+        )
+        if cur.rowcount == 0:
+            return None
+        row = conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM broadcast_jobs WHERE owner = ? AND status = 'running' AND heartbeat = ?",
+            (owner, now),
+        ).fetchone()
+    return dict(row) if row else None
+
+def _release_broadcast_job(job_id, owner):
+    # Аренда отдается сразу при остановке, чтобы следующий процесс не ждал ее истечения
+    conn = _get_conn()
+    with conn:
+        conn.execute(
+            "UPDATE broadcast_jobs SET owner = NULL, heartbeat = NULL WHERE id = ? AND owner = ? AND status = 'running'",
+            (job_id, owner),
+        )
+
+def _get_recent_broadcast_jobs(limit):
+    rows = _get_conn().execute(
+        f"SELECT {_JOB_COLUMNS} FROM broadcast_jobs ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def _start_broadcast_job(job_id, total):
+    conn = _get_conn()
+    with conn:
+        conn.execute(
+            """
+            UPDATE broadcast_jobs SET status = 'running', total = ?, started_at = strftime('%s', 'now')
+            WHERE id = ?
+            """,
+            (total, job_id),
+        )
+
+def _record_broadcast_progress(job_id, owner, rows, cursor, sent, blocked, failed):
+    conn = _get_conn()
+    with conn:
+        # Запись прогресса продлевает аренду; 0 строк — задание перехватил другой процесс
+        cur = conn.execute(
+            """
+            UPDATE broadcast_jobs SET cursor = ?, sent = ?, blocked = ?, failed = ?, heartbeat = ?
+            WHERE id = ? AND owner = ?
+            """,
+            (cursor, sent, blocked, failed, int(time.time()), job_id, owner),
+        )
+        if cur.rowcount == 0:
+            return False
+        conn.executemany(
+            """
+            INSERT INTO broadcast_deliveries (job_id, user_id, status, error) VALUES (?, ?, ?, ?)
+            ON CONFLICT (job_id, user_id) DO UPDATE SET
+                status = excluded.status, error = excluded.error, attempts = attempts + 1
+            """,
+            rows,
+        )
+    return True
+
+def _get_delivered_after(job_id, cursor):
+    rows = _get_conn().execute(
+        "SELECT user_id FROM broadcast_deliveries WHERE job_id = ? AND user_id > ?", (job_id, cursor)
+    ).fetchall()
+    return {row[0] for row in rows}
+
+def _get_retryable_deliveries(job_id, max_attempts):
+    rows = _get_conn().execute(
+        """
+        SELECT user_id FROM broadcast_deliveries
+        WHERE job_id = ? AND status = 'retry' AND attempts < ?
+        ORDER BY user_id
+        """,
+        (job_id, max_attempts),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def _finish_broadcast_job(job_id, owner, status):
+    conn = _get_conn()
+    with conn:
+        conn.execute(
+            """
+            UPDATE broadcast_jobs SET status = ?, finished_at = strftime('%s', 'now'), owner = NULL, heartbeat = NULL
+            WHERE id = ? AND owner = ?
+            """,
+            (status, job_id, owner),
+        )
+
+async def create_broadcast_job(
+    from_chat_id, message_id, service=None, created_by=None, status_chat_id=None, status_message_id=None
+):
+    try:
+        return await _run(
+            _create_broadcast_job, from_chat_id, message_id, service, created_by, status_chat_id, status_message_id
+        )
+    except Exception as e:
+        logger.error(f"Ошибка создания рассылки: {e}")
+        raise DBError("Не удалось создать рассылку")
+
+async def claim_broadcast_job(owner, lease):
+    now = int(time.time())
+    try:
+        return await _run(_claim_broadcast_job, owner, now, now - lease)
+    except Exception as e:
+        logger.error(f"Ошибка получения рассылки: {e}")
+        raise DBError("Не удалось получить рассылку")
+
+async def release_broadcast_job(job_id, owner):
+    try:
+        await _run(_release_broadcast_job, job_id, owner)
+    except Exception as e:
+        logger.error(f"Ошибка освобождения рассылки {job_id}: {e}")
+        raise DBError("Не удалось освободить рассылку")
+
+async def get_recent_broadcast_jobs(limit=5):
+    try:
+        return await _run(_get_recent_broadcast_jobs, limit)
+    except Exception as e:
+        logger.error(f"Ошибка получения рассылок: {e}")
+        raise DBError("Не удалось получить рассылки")
+
+async def start_broadcast_job(job_id, total):
+    try:
+        await _run(_start_broadcast_job, job_id, total)
+    except Exception as e:
+        logger.error(f"Ошибка запуска рассылки {job_id}: {e}")
+        raise DBError("Не удалось запустить рассылку")
+
+async def record_broadcast_progress(job_id, owner, rows, cursor, sent, blocked, failed):
+    try:
+        return await _run(_record_broadcast_progress, job_id, owner, rows, cursor, sent, blocked, failed)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения прогресса рассылки {job_id}: {e}")
+        raise DBError("Не удалось сохранить прогресс рассылки")
+
+async def get_delivered_after(job_id, cursor):
+    try:
+        return await _run(_get_delivered_after, job_id, cursor)
+    except Exception as e:
+        logger.error(f"Ошибка получения доставок рассылки {job_id}: {e}")
+        raise DBError("Не удалось получить доставки рассылки")
+
+async def get_retryable_deliveries(job_id, max_attempts):
+    try:
+        return await _run(_get_retryable_deliveries, job_id, max_attempts)
+    except Exception as e:
+        logger.error(f"Ошибка получения повторов рассылки {job_id}: {e}")
+        raise DBError("Не удалось получить повторы рассылки")
+
+async def finish_broadcast_job(job_id, owner, status="done"):
+    try:
+        await _run(_finish_broadcast_job, job_id, owner, status)
+    except Exception as e:
+        logger.error(f"Ошибка завершения рассылки {job_id}: {e}")
+        raise DBError("Не удалось завершить рассылку")
+
+# Состояния FSM
+# Запись с истекшим expires_at считается отсутствующей: новое состояние начинается с пустых данных
+def _get_fsm_record(key, now):
+    row = _get_conn().execute(
+        "SELECT state, data FROM fsm_storage WHERE key = ? AND expires_at >= ?", (key, now)
+    ).fetchone()
+    return (row[0], row[1]) if row else (None, "{}")
+
+def _set_fsm_state(key, state, expires_at, now):
+    conn = _get_conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO fsm_storage (key, state, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                state = excluded.state,
+                data = CASE WHEN fsm_storage.expires_at < ? THEN '{}' ELSE fsm_storage.data END,
+                expires_at = excluded.expires_at
+            """,
+            (key, state, expires_at, now),
+        )
+        conn.execute("DELETE FROM fsm_storage WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+def _set_fsm_data(key, data, expires_at, now):
+    conn = _get_conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO fsm_storage (key, data, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                state = CASE WHEN fsm_storage.expires_at < ? THEN NULL ELSE fsm_storage.state END,
+                data = excluded.data,
+                expires_at = excluded.expires_at
+            """,
+            (key, data, expires_at, now),
+        )
+        conn.execute("DELETE FROM fsm_storage WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+def _purge_fsm(now):
+    conn = _get_conn()
+    with conn:
+        cur = conn.execute("DELETE FROM fsm_storage WHERE expires_at < ?", (now,))
+    return cur.rowcount
+
+async def get_fsm_record(key):
+    try:
+        return await _run(_get_fsm_record, key, int(time.time()))
+    except Exception as e:
+        logger.error(f"Ошибка чтения состояния {key}: {e}")
+        raise DBError("Не удалось прочитать состояние")
+
+async def set_fsm_state(key, state, ttl):
+    now = int(time.time())
+    try:
+        await _run(_set_fsm_state, key, state, now + ttl, now)
+    except Exception as e:
+        logger.error(f"Ошибка записи состояния {key}: {e}")
+        raise DBError("Не удалось записать состояние")
+
+async def set_fsm_data(key, data, ttl):
+    now = int(time.time())
+    try:
+        await _run(_set_fsm_data, key, data, now + ttl, now)
+    except Exception as e:
+        logger.error(f"Ошибка записи данных состояния {key}: {e}")
+        raise DBError("Не удалось записать данные состояния")
+
+async def purge_fsm():
+    try:
+        return await _run(_purge_fsm, int(time.time()))
+    except Exception as e:
+        logger.error(f"Ошибка очистки состояний: {e}")
+        return 0
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Должно совпадать с картой apps в make_graph.js
+APPS = {
+    "telegram": "Telegram",
+    "youtube": "YouTube",
+    "vkontakte": "ВКонтакте",
+    "tiktok": "TikTok",
+}
+GRAPHS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "graphs")
+GRAPH_TTL = 30
+# Снимки старше этого считаются устаревшими (сервис съемки не работает)
+STALE_AFTER = 30 * 60
+
+
+@dataclass
+class Graph:
+    app: str
+    data: bytes
+    sha256: str
+    captured_at: int
+    file_id: str = None
+
+    @property
+    def age(self):
+        return max(0, int(time.time()) - self.captured_at)
+
+    @property
+    def is_stale(self):
+        return self.age > STALE_AFTER
+
+
+class GraphStore:
+    # Читает PNG, которые пишет make_graph.js --serve; пользователь никогда не ждет браузер
+    def __init__(self, directory=GRAPHS_DIR, ttl=GRAPH_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._graphs = {}
+        self._checked_at = {}
+        self._locks = {}
+        self._upload_locks = {}
+
+    def _read_meta(self, app):
+        path = os.path.join(self.directory, f"{app}_graph.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _load(self, app, current):
+        meta = self._read_meta(app)
+        if meta is None:
+            return None
+        if current and current.sha256 == meta["sha256"]:
+            return current
+        with open(os.path.join(self.directory, f"{app}_graph.png"), "rb") as f:
+            data = f.read()
+        return Graph(app=app, data=data, sha256=meta["sha256"], captured_at=int(meta["captured_at"]))
+
+    async def get(self, app):
+        if app not in APPS:
+            return None
+        now = time.monotonic()
+        if now - self._checked_at.get(app, float("-inf")) < self.ttl:
+            return self._graphs.get(app)
+
+        lock = self._locks.setdefault(app, asyncio.Lock())
+        async with lock:
+            if time.monotonic() - self._checked_at.get(app, float("-inf")) < self.ttl:
+                return self._graphs.get(app)
+            try:
+                graph = await asyncio.to_thread(self._load, app, self._graphs.get(app))
+            except Exception as e:
+                logger.error(f"Ошибка чтения графика {app}: {e}")
+                graph = self._graphs.get(app)
+            self._checked_at[app] = time.monotonic()
+            if graph is not None:
+                self._graphs[app] = graph
+            return graph
+
+    def upload_lock(self, app):
+        return self._upload_locks.setdefault(app, asyncio.Lock())
+
+
+graph_store = GraphStore()
+
+# Ответы Bot API, после которых сохраненный file_id больше не годится
+FILE_ID_ERRORS = ("file identifier", "file reference", "file_reference")
+
+
+async def _send_cached(bot, chat_id, graph, caption):
+    file_id = graph.file_id or await db.get_file_id(graph.sha256)
+    if not file_id:
+        return None
+    try:
+        message = await bot.send_photo(chat_id, file_id, caption=caption)
+    except TelegramBadRequest as e:
+        # Прочие ошибки (чат не найден и т.п.) к file_id не относятся — он остается в кэше
+        if not any(marker in e.message.lower() for marker in FILE_ID_ERRORS):
+            raise
+        # file_id стал недействительным: удаляем и загружаем заново
+        logger.warning(f"file_id графика {graph.app} отклонен: {e}")
+        graph.file_id = None
+        await db.drop_file_id(graph.sha256)
+        return None
+    graph.file_id = file_id
+    return message
+
+
+async def send_graph_photo(bot: Bot, chat_id, graph, caption=None):
+    # Каждая версия PNG загружается в Telegram один раз, дальше отправляется по file_id
+    message = await _send_cached(bot, chat_id, graph, caption)
+    if message:
+        return message
+    async with graph_store.upload_lock(graph.app):
+        message = await _send_cached(bot, chat_id, graph, caption)
+        if message:
+            return message
+        message = await bot.send_photo(
+            chat_id, BufferedInputFile(graph.data, filename=f"{graph.app}.png"), caption=caption
+        )
+        graph.file_id = message.photo[-1].file_id
+        await db.save_file_id(graph.sha256, f"graph:{graph.app}", graph.file_id)
+        return message
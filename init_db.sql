@@ -1,5 +1,5 @@
 
--CREATE TABLE IF NOT EXISTS users (
+CREATE TABLE IF NOT EXISTS users (
     user_id INTEGER PRIMARY KEY,
     name TEXT,
     referral_id INTEGER,
@@ -7,9 +7,171 @@
     is_blocked BOOLEAN DEFAULT 0
 );
 
+-- Инциденты: ts — unix-время в секундах, service — ключ из карты apps (NULL — общий)
 CREATE TABLE IF NOT EXISTS messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    time TEXT,
-    text TEXT
+    ts INTEGER NOT NULL,
+    service TEXT,
+    text TEXT NOT NULL
 );
 
+CREATE INDEX IF NOT EXISTS idx_messages_feed ON messages (ts, service, text);
+CREATE INDEX IF NOT EXISTS idx_messages_service ON messages (service, ts, text);
+
+CREATE INDEX IF NOT EXISTS idx_users_active ON users (is_blocked, user_id);
+
+-- Счетчики пользователей поддерживаются триггерами, чтобы не считать всю таблицу
+CREATE TABLE IF NOT EXISTS user_counters (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO user_counters (id, total, blocked)
+SELECT 1, COUNT(*), COALESCE(SUM(COALESCE(is_blocked, 0) != 0), 0) FROM users;
+
+CREATE TRIGGER IF NOT EXISTS users_counters_insert AFTER INSERT ON users
+BEGIN
+    UPDATE user_counters
+    SET total = total + 1, blocked = blocked + (COALESCE(NEW.is_blocked, 0) != 0)
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_counters_block AFTER UPDATE OF is_blocked ON users
+WHEN (COALESCE(OLD.is_blocked, 0) != 0) != (COALESCE(NEW.is_blocked, 0) != 0)
+BEGIN
+    UPDATE user_counters
+    SET blocked = blocked + (CASE WHEN COALESCE(NEW.is_blocked, 0) != 0 THEN 1 ELSE -1 END)
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_counters_delete AFTER DELETE ON users
+BEGIN
+    UPDATE user_counters
+    SET total = total - 1, blocked = blocked - (COALESCE(OLD.is_blocked, 0) != 0)
+    WHERE id = 1;
+END;
+
+CREATE INDEX IF NOT EXISTS idx_users_referral ON users (referral_id);
+
+-- Лидерборд рефералов обновляется инкрементально при добавлении пользователя
+CREATE TABLE IF NOT EXISTS referral_counts (
+    user_id INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_referral_counts_rank ON referral_counts (count, user_id);
+
+-- Сколько рефереров имеют данное число приглашенных: ранг без подсчета всех строк выше
+CREATE TABLE IF NOT EXISTS referral_count_hist (
+    count INTEGER PRIMARY KEY,
+    referrers INTEGER NOT NULL
+);
+
+INSERT INTO referral_counts (user_id, count)
+SELECT referral_id, COUNT(*) FROM users
+WHERE referral_id IS NOT NULL AND referral_id != user_id
+  AND NOT EXISTS (SELECT 1 FROM referral_counts)
+GROUP BY referral_id;
+
+INSERT INTO referral_count_hist (count, referrers)
+SELECT count, COUNT(*) FROM referral_counts
+WHERE NOT EXISTS (SELECT 1 FROM referral_count_hist)
+GROUP BY count;
+
+CREATE TRIGGER IF NOT EXISTS users_referral_insert AFTER INSERT ON users
+WHEN NEW.referral_id IS NOT NULL AND NEW.referral_id != NEW.user_id
+BEGIN
+    INSERT INTO referral_counts (user_id, count) VALUES (NEW.referral_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS referral_counts_insert AFTER INSERT ON referral_counts
+BEGIN
+    INSERT INTO referral_count_hist (count, referrers) VALUES (NEW.count, 1)
+    ON CONFLICT (count) DO UPDATE SET referrers = referrers + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS referral_counts_update AFTER UPDATE OF count ON referral_counts
+BEGIN
+    UPDATE referral_count_hist SET referrers = referrers - 1 WHERE count = OLD.count;
+    DELETE FROM referral_count_hist WHERE count = OLD.count AND referrers <= 0;
+    INSERT INTO referral_count_hist (count, referrers) VALUES (NEW.count, 1)
+    ON CONFLICT (count) DO UPDATE SET referrers = referrers + 1;
+END;
+
+-- Telegram file_id загруженных файлов по sha256 содержимого
+CREATE TABLE IF NOT EXISTS media_cache (
+    content_hash TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_cache_source ON media_cache (source);
+
+-- Рассылки переживают перезапуск: задание, курсор по user_id и статус каждого получателя
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    from_chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    -- NULL — все активные пользователи, иначе подписчики сервиса
+    service TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    cursor INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_by INTEGER,
+    status_chat_id INTEGER,
+    status_message_id INTEGER,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+    started_at INTEGER,
+    finished_at INTEGER,
+    -- Аренда задания: какой процесс его выполняет и когда последний раз отметился
+    owner TEXT,
+    heartbeat INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status, id);
+
+CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+    job_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    error TEXT,
+    PRIMARY KEY (job_id, user_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_status ON broadcast_deliveries (job_id, status, attempts);
+
+-- Число жалоб по сервисам из данных графиков downdetector (outages.py).
+-- WITHOUT ROWID: строка хранится прямо в B-дереве ключа (service, ts), без отдельного rowid
+CREATE TABLE IF NOT EXISTS outage_samples (
+    service TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (service, ts)
+) WITHOUT ROWID;
+
+-- Подписки на сервисы: получатели оповещения — диапазон первичного ключа, без скана users
+CREATE TABLE IF NOT EXISTS subscriptions (
+    service TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+    PRIMARY KEY (service, user_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id);
+
+-- Состояния FSM aiogram (storage.SQLiteStorage); общие для всех процессов бота
+CREATE TABLE IF NOT EXISTS fsm_storage (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    expires_at INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_fsm_storage_expires ON fsm_storage (expires_at);
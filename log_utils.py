@@ -0,0 +1,84 @@
+import logging
+import logging.handlers
+import os
+import queue
+from collections import deque
+
+LOG_PATH = "bot.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+LOG_FORMAT = "[%(asctime)s] %(levelname)s - %(name)s - %(message)s"
+
+_listener = None
+
+
+class RecentErrorsHandler(logging.Handler):
+    # Кольцевой буфер последних ошибок: админка читает его без обращения к диску
+    def __init__(self, capacity=200, level=logging.ERROR):
+        super().__init__(level)
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        try:
+            self.records.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def recent(self, limit=20, contains=None):
+        # list() копирует deque атомарно, пока поток логгера дописывает новые записи
+        records = list(self.records)
+        if contains:
+            needle = contains.lower()
+            records = [r for r in records if needle in r.lower()]
+        return records[-limit:]
+
+
+recent_errors = RecentErrorsHandler()
+
+
+def setup_logging(level=logging.INFO, path=LOG_PATH):
+    global _listener
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler, recent_errors):
+        handler.setFormatter(formatter)
+
+    # Обработчики event loop только кладут записи в очередь, запись на диск — в потоке слушателя
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, recent_errors, respect_handler_level=True
+    )
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def tail(path, lines=20, block_size=4096):
+    # Читаем файл блоками с конца, пока не наберется нужное число строк
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= lines:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return [line.decode("utf-8", errors="replace") for line in data.splitlines()[-lines:]]
@@ -1,4 +1,5 @@
 import asyncio
+import html
 import logging
 import os
 from datetime import datetime
@@ -6,7 +7,6 @@ from zoneinfo import ZoneInfo
 
 from aiogram import Bot, Dispatcher, F, Router, types
 from aiogram.enums import ParseMode, ContentType
-from aiogram.exceptions import TelegramForbiddenError
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import (
@@ -16,30 +16,50 @@ from aiogram.types import (
     Message,
 )
 from middlewares import RateLimiterMiddleware, ErrorHandlerMiddleware
+import broadcast
 import config
 import db
+import graphs
+import log_utils
+import metrics
+import notifications
+import outages
+import scheduler
+import storage
+import webhook
 
 # Логирование
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s] %(levelname)s - %(name)s - %(message)s",
-    handlers=[
-        logging.FileHandler("bot.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+log_utils.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Бот и диспетчер
 bot = Bot(token=config.BOT_TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher()
+dp = Dispatcher(storage=storage.SQLiteStorage(ttl=config.FSM_STATE_TTL))
+
+ADMIN_LOG_ID = config.ADMIN_IDS[0] if config.ADMIN_IDS else None
+# Регистрации уходят администраторам сводкой, а не сообщением на каждый /start
+notifier = notifications.Notifier(
+    bot, ADMIN_LOG_ID, interval=config.DIGEST_INTERVAL, max_items=config.DIGEST_MAX_ITEMS
+)
 
 # Middlewares
-dp.message.middleware(RateLimiterMiddleware())
-dp.callback_query.middleware(RateLimiterMiddleware())
-dp.update.middleware(ErrorHandlerMiddleware())
+# Планировщик стоит перед всеми хэндлерами: ограниченный пул воркеров вместо задачи на каждое обновление
+update_scheduler = scheduler.UpdateScheduler(
+    workers=config.UPDATE_WORKERS,
+    max_queue=config.UPDATE_QUEUE_SIZE,
+    max_per_chat=config.UPDATE_CHAT_QUEUE_SIZE,
+    admin_ids=config.ADMIN_IDS,
+)
+dp.update.outer_middleware(update_scheduler)
+rate_limiter = RateLimiterMiddleware(rate=config.RATE_LIMIT, burst=config.RATE_BURST, costs=config.RATE_COSTS)
+dp.message.middleware(rate_limiter)
+dp.callback_query.middleware(rate_limiter)
+dp.message.middleware(metrics.MetricsMiddleware())
+dp.callback_query.middleware(metrics.MetricsMiddleware())
+dp.update.middleware(ErrorHandlerMiddleware(notify=notifier.critical))
+bot.session.middleware(metrics.ApiMetricsMiddleware())
 
-router = Router()
+router = Router(name="main")
 
 # Состояния
 class EditNameState(StatesGroup):
@@ -52,16 +72,40 @@ class BroadcastStates(StatesGroup):
 # Главное меню
 main_menu = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="⚠️Последние сбои", callback_data="menu_last")],
+    [InlineKeyboardButton(text="📉 Графики сбоев", callback_data="menu_graphs")],
+    [InlineKeyboardButton(text="🔔 Подписки", callback_data="menu_subs")],
     [InlineKeyboardButton(text="🔗Реферальная ссылка", callback_data="menu_ref")],
     [InlineKeyboardButton(text="🎭 Информация обо мне", callback_data="menu_me")],
     [InlineKeyboardButton(text="👥 Администраторы бота", callback_data="menu_admins")],
     [InlineKeyboardButton(text="🕹️Доступные команды", callback_data="menu_commands")],
 ])
 
+profile_menu = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✏️ Отредактировать имя", callback_data="edit_name")],
+    [InlineKeyboardButton(text="⬅️ Назад", callback_data="menu_main")],
+])
+
+graphs_menu = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=title, callback_data=f"graph_{app}")]
+    for app, title in graphs.APPS.items()
+])
+
+def subscriptions_menu(user_id):
+    subscribed = db.get_subscriptions(user_id)
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=f"{'✅' if app in subscribed else '▫️'} {title}", callback_data=f"sub_{app}"
+        )]
+        for app, title in graphs.APPS.items()
+    ])
+
+SUBSCRIPTIONS_TEXT = "🔔 <b>Подписки</b>\nОповещения о сбоях приходят только по отмеченным сервисам:"
+
 WELCOME_TEXT = config.WELCOME_TEXT
 
 COMMANDS_TEXT = (
-    "/last - последние сообщения от админов\n"
+    "/last - последние сбои\n"
+    "/graph - графики сбоев сервисов\n"
     "/ref - ваша реферальная ссылка\n"
     "/refstats - топ-10 по рефералам\n"
     "/admins - администраторы бота\n"
@@ -75,30 +119,47 @@ ADMIN_TEXT = (
     "🧑‍💻@overnightwatch - кодер"
 )
 
-ADMIN_LOG_ID = config.ADMIN_IDS[0] if config.ADMIN_IDS else None
+TZ = ZoneInfo(config.TIMEZONE)
+
+# Готовый текст ленты /last; пересобирается только после вставки нового инцидента
+# (в том числе другим процессом — см. db.incidents_version)
+_last_feed = {"version": None, "text": None}
 
 # Вспомогательные функции
-async def send_ref_stats_page(user_id, page=1, page_size=10):
+async def send_ref_stats_page(user_id, page=1, cursor=None, backward=False, page_size=10):
     try:
-        top = db.get_top_referrers(limit=page_size*2)
-        if not top:
+        # Keyset-пагинация: в callback_data передается (count, user_id) граничной строки
+        rows = await db.get_referrers_page(page_size + 1, cursor, backward)
+        if backward:
+            has_next = True
+            page_data = rows[-page_size:]
+        else:
+            has_next = len(rows) > page_size
+            page_data = rows[:page_size]
+        if not page_data:
             return "👥 Пока никто не пригласил других пользователей.", None
 
-        total_pages = (len(top) + page_size - 1) // page_size
+        total = await db.get_referrer_total()
+        total_pages = max(page, (total + page_size - 1) // page_size)
         start = (page - 1) * page_size
-        end = start + page_size
-        page_data = top[start:end]
 
         text = f"👥 <b>Топ рефералов (стр. {page}/{total_pages}):</b>\n"
         for i, row in enumerate(page_data, start+1):
             name = row['name'] or f"ID {row['user_id']}"
             text += f"{i}. {name} - {row['count']}\n"
 
-        kb = InlineKeyboardMarkup()
+        buttons = []
         if page > 1:
-            kb.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"refstats_{page-1}"))
-        if end < len(top):
-            kb.add(InlineKeyboardButton("Вперед ➡️", callback_data=f"refstats_{page+1}"))
+            first = page_data[0]
+            buttons.append(InlineKeyboardButton(
+                text="⬅️ Назад", callback_data=f"refstats_{page-1}_p_{first['count']}_{first['user_id']}"
+            ))
+        if has_next:
+            last = page_data[-1]
+            buttons.append(InlineKeyboardButton(
+                text="Вперед ➡️", callback_data=f"refstats_{page+1}_n_{last['count']}_{last['user_id']}"
+            ))
+        kb = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
 
         return text, kb
     except Exception as e:
@@ -107,12 +168,13 @@ async def send_ref_stats_page(user_id, page=1, page_size=10):
 
 async def send_user_info(user_id, msg_or_cb):
     try:
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         if not user:
             await msg_or_cb.answer("Информация не найдена.")
             return
 
-        ref_count = db.get_referral_count(user_id)
+        ref_rank = await db.get_referral_rank(user_id)
+        ref_count = ref_rank["count"] if ref_rank else 0
         text = (
             f"👤 <b>Информация о пользователе</b>\n"
             f"Имя: {user['name']}\n"
@@ -121,15 +183,41 @@ async def send_user_info(user_id, msg_or_cb):
             f"Дата входа: {user['joined_at']}\n"
             f"👥 Приглашено пользователей: {ref_count}"
         )
-        kb = InlineKeyboardMarkup().add(
-            InlineKeyboardButton("✏️ Отредактировать имя", callback_data="edit_name"),
-            InlineKeyboardButton("⬅️ Назад", callback_data="menu_main")
-        )
-        await bot.send_message(user_id, text, reply_markup=kb)
+        if ref_rank:
+            text += f"\n🏆 Место в рейтинге рефералов: {ref_rank['rank']}"
+        await bot.send_message(user_id, text, reply_markup=profile_menu)
     except Exception as e:
         logger.error(f"Ошибка в send_user_info: {e}")
         await msg_or_cb.answer("⚠️ Произошла ошибка при загрузке информации")
 
+def format_cache_stats(stats):
+    lines = ["🗄 <b>Кэш:</b>"]
+    for name, st in stats.items():
+        lines.append(
+            f"{name}: {st['size']}/{st['maxsize']}, попаданий {st['hits']}, "
+            f"промахов {st['misses']} ({st['hit_rate']:.0%})"
+        )
+    return "\n".join(lines)
+
+async def render_last_feed():
+    version = await db.incidents_version()
+    if _last_feed["version"] == version:
+        return _last_feed["text"]
+
+    rows = await db.get_last_messages(config.LAST_FEED_LIMIT)
+    if not rows:
+        text = "✅ Сбоев пока не зафиксировано."
+    else:
+        lines = ["⚠️ <b>Последние сбои:</b>"]
+        for row in rows:
+            when = datetime.fromtimestamp(row["ts"], TZ).strftime("%d.%m %H:%M")
+            service = graphs.APPS.get(row["service"], row["service"])
+            prefix = f"<b>{html.escape(service)}</b>: " if service else ""
+            lines.append(f"\n🕒 {when}\n{prefix}{html.escape(row['text'])}")
+        text = "\n".join(lines)
+    _last_feed.update(version=version, text=text)
+    return text
+
 # Обработчики команд
 @router.message(F.text.startswith("/start"))
 async def handle_start(message: Message):
@@ -138,19 +226,14 @@ async def handle_start(message: Message):
         ref_id = int(args[1]) if len(args) > 1 and args[1].isdigit() else None
         user_id = message.from_user.id
 
-        if db.get_user(user_id):
+        if await db.get_user(user_id):
             await message.answer(WELCOME_TEXT, reply_markup=main_menu)
             return
 
         full_name = f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip()
-        db.add_user(user_id, name=full_name, referral_id=ref_id)
+        await db.add_user(user_id, name=full_name, referral_id=ref_id)
         await message.answer(WELCOME_TEXT, reply_markup=main_menu)
-
-        if ref_id and ref_id != user_id and ADMIN_LOG_ID:
-            await bot.send_message(
-                ADMIN_LOG_ID,
-                f"👤 Новый пользователь: {full_name} зарегистрировался по рефералке от ID {ref_id}"
-            )
+        notifier.signup(user_id, ref_id)
     except Exception as e:
         logger.error(f"Ошибка в handle_start: {e}")
         await message.answer("⚠️ Произошла ошибка при регистрации")
@@ -180,8 +263,14 @@ async def ref_stats(message: Message):
 @router.callback_query(F.data.startswith("refstats_"))
 async def ref_stats_page(callback: CallbackQuery):
     try:
-        page = int(callback.data.split("_")[1])
-        text, kb = await send_ref_stats_page(callback.from_user.id, page)
+        parts = callback.data.split("_")
+        if len(parts) == 5:
+            page = int(parts[1])
+            cursor = (int(parts[3]), int(parts[4]))
+            text, kb = await send_ref_stats_page(callback.from_user.id, page, cursor, parts[2] == "p")
+        else:
+            # Кнопки из старых сообщений без курсора открывают первую страницу
+            text, kb = await send_ref_stats_page(callback.from_user.id)
         if kb:
             await callback.message.edit_text(text, reply_markup=kb)
         else:
@@ -201,8 +290,11 @@ async def admin_panel(message: Message):
 
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="📬 Рассылка", callback_data="admin_broadcast")],
+            [InlineKeyboardButton(text="📡 Статус рассылок", callback_data="admin_broadcasts")],
             [InlineKeyboardButton(text="📈 Статистика", callback_data="admin_stats")],
+            [InlineKeyboardButton(text="⏱ Метрики", callback_data="admin_metrics")],
             [InlineKeyboardButton(text="🧾 Лог ошибок", callback_data="admin_logs")],
+            [InlineKeyboardButton(text="⛔ Последние ошибки", callback_data="admin_errors")],
         ])
         await message.answer("🔧 Панель администратора:", reply_markup=kb)
     except Exception as e:
@@ -212,7 +304,12 @@ async def admin_panel(message: Message):
 @router.callback_query(F.data == "admin_broadcast")
 async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
     try:
-        await cmd_broadcast(callback.message, state)
+        # callback.message отправлен ботом, поэтому права проверяются по нажавшему кнопку
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⚠️ Только для администраторов.")
+            return
+        await begin_broadcast(callback.message, state)
+        await callback.answer()
     except Exception as e:
         logger.error(f"Ошибка в admin_broadcast: {e}")
         await callback.answer("⚠️ Произошла ошибка")
@@ -220,36 +317,196 @@ async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "admin_stats")
 async def admin_stats(callback: CallbackQuery):
     try:
-        count = len(db.get_all_users())
-        await callback.message.answer(f"📊 Зарегистрированных пользователей: <b>{count}</b>")
+        counts = await db.get_user_counts()
+        await callback.message.answer(
+            f"📊 Зарегистрированных пользователей: <b>{counts['total']}</b>\n"
+            f"✅ Активных: <b>{counts['active']}</b>\n"
+            f"❌ Заблокировали бота: <b>{counts['blocked']}</b>\n\n"
+            + format_cache_stats(db.cache_stats())
+        )
     except Exception as e:
         logger.error(f"Ошибка в admin_stats: {e}")
         await callback.message.answer("⚠️ Произошла ошибка при загрузке статистики")
     finally:
         await callback.answer()
 
+@router.callback_query(F.data == "admin_metrics")
+async def admin_metrics(callback: CallbackQuery):
+    if callback.from_user.id not in config.ADMIN_IDS:
+        await callback.answer("⚠️ Только для администраторов.")
+        return
+    try:
+        await callback.message.answer("⏱ <b>Метрики:</b>\n\n" + metrics.summary())
+    except Exception as e:
+        logger.error(f"Ошибка в admin_metrics: {e}")
+        await callback.message.answer("⚠️ Не удалось загрузить метрики")
+    finally:
+        await callback.answer()
+
 @router.callback_query(F.data == "admin_logs")
 async def admin_logs(callback: CallbackQuery):
     try:
-        if not os.path.exists("bot.log"):
+        if not os.path.exists(log_utils.LOG_PATH):
             await callback.message.answer("⚠️ Файл логов не найден")
             return
 
-        with open("bot.log", "r", encoding="utf-8") as f:
-            last_lines = f.readlines()[-20:]
+        last_lines = await asyncio.to_thread(log_utils.tail, log_utils.LOG_PATH, 20)
         
         if not last_lines:
             await callback.message.answer("🧾 Лог пуст")
             return
 
-        text = "<b>🧾 Последние строки из лога:</b>\n\n" + "".join(last_lines)
-        await callback.message.answer(f"<code>{text}</code>", parse_mode=ParseMode.HTML)
+        text = html.escape("\n".join(last_lines))[-3800:]
+        await callback.message.answer(
+            f"<b>🧾 Последние строки из лога:</b>\n\n<code>{text}</code>", parse_mode=ParseMode.HTML
+        )
     except Exception as e:
         logger.error(f"Ошибка загрузки логов: {e}")
-        await callback.message.answer(f"⚠️ Не удалось загрузить лог: {e}")
+        await callback.message.answer(f"⚠️ Не удалось загрузить лог: {html.escape(str(e))}")
+    finally:
+        await callback.answer()
+
+async def send_recent_errors(message: Message, contains=None):
+    errors = log_utils.recent_errors.recent(limit=10, contains=contains)
+    if not errors:
+        await message.answer("✅ Ошибок не найдено")
+        return
+    text = html.escape("\n\n".join(errors))[-3800:]
+    await message.answer(f"<b>⛔ Последние ошибки:</b>\n\n<code>{text}</code>")
+
+@router.callback_query(F.data == "admin_errors")
+async def admin_errors(callback: CallbackQuery):
+    if callback.from_user.id not in config.ADMIN_IDS:
+        await callback.answer("⚠️ Только для администраторов.")
+        return
+    try:
+        await send_recent_errors(callback.message)
+    except Exception as e:
+        logger.error(f"Ошибка в admin_errors: {e}")
+        await callback.message.answer("⚠️ Не удалось загрузить ошибки")
+    finally:
+        await callback.answer()
+
+@router.message(F.text.startswith("/errors"))
+async def cmd_errors(message: Message):
+    try:
+        if message.from_user.id not in config.ADMIN_IDS:
+            await message.reply("⚠️ Эта команда только для администраторов.")
+            return
+        args = message.text.split(maxsplit=1)
+        await send_recent_errors(message, args[1] if len(args) > 1 else None)
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_errors: {e}")
+        await message.answer("⚠️ Не удалось загрузить ошибки")
+
+async def send_graph(chat_id, app):
+    graph = await graphs.graph_store.get(app)
+    if graph is None:
+        await bot.send_message(chat_id, "⚠️ График пока недоступен, попробуйте позже.")
+        return
+    caption = f"📉 {graphs.APPS[app]}: снимок {graph.age // 60} мин назад"
+    if graph.is_stale:
+        caption += " (данные устарели)"
+    await graphs.send_graph_photo(bot, chat_id, graph, caption)
+
+@router.message(F.text == "/graph")
+async def cmd_graph(message: Message):
+    try:
+        await message.answer("📉 Выберите сервис:", reply_markup=graphs_menu)
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_graph: {e}")
+        await message.answer("⚠️ Произошла ошибка")
+
+@router.callback_query(F.data == "menu_graphs")
+async def menu_graphs(callback: CallbackQuery):
+    try:
+        await callback.message.answer("📉 Выберите сервис:", reply_markup=graphs_menu)
+    except Exception as e:
+        logger.error(f"Ошибка в menu_graphs: {e}")
+        await callback.answer("⚠️ Произошла ошибка")
+    finally:
+        await callback.answer()
+
+@router.callback_query(F.data.startswith("graph_"))
+async def graph_callback(callback: CallbackQuery):
+    try:
+        app = callback.data.split("_", 1)[1]
+        if app in graphs.APPS:
+            await send_graph(callback.from_user.id, app)
+    except Exception as e:
+        logger.error(f"Ошибка в graph_callback: {e}")
+        await callback.message.answer("⚠️ Не удалось загрузить график")
     finally:
         await callback.answer()
 
+@router.message(F.text == "/last")
+async def cmd_last(message: Message):
+    try:
+        await message.answer(await render_last_feed())
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_last: {e}")
+        await message.answer("⚠️ Произошла ошибка при загрузке сбоев")
+
+@router.callback_query(F.data == "menu_last")
+async def menu_last(callback: CallbackQuery):
+    try:
+        await callback.message.answer(await render_last_feed())
+    except Exception as e:
+        logger.error(f"Ошибка в menu_last: {e}")
+        await callback.message.answer("⚠️ Произошла ошибка при загрузке сбоев")
+    finally:
+        await callback.answer()
+
+@router.message(F.text.startswith("/incident"))
+async def cmd_incident(message: Message):
+    try:
+        if message.from_user.id not in config.ADMIN_IDS:
+            await message.reply("⚠️ Эта команда только для администраторов.")
+            return
+        args = message.text.split(maxsplit=2)
+        if len(args) < 2:
+            await message.answer("Использование: /incident [сервис] текст")
+            return
+        service = args[1] if args[1] in graphs.APPS else None
+        text = args[2] if service and len(args) > 2 else message.text.split(maxsplit=1)[1]
+        await db.add_incident(text, service)
+        if service:
+            job_id = await alert_subscribers(service, text)
+            note = f", оповещение подписчикам — рассылка #{job_id}" if job_id else ""
+            await message.answer(f"✅ Инцидент добавлен{note}")
+        else:
+            await message.answer("✅ Инцидент добавлен")
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_incident: {e}")
+        await message.answer("⚠️ Не удалось добавить инцидент")
+
+@router.callback_query(F.data == "menu_subs")
+async def menu_subs(callback: CallbackQuery):
+    try:
+        await callback.message.answer(SUBSCRIPTIONS_TEXT, reply_markup=subscriptions_menu(callback.from_user.id))
+    except Exception as e:
+        logger.error(f"Ошибка в menu_subs: {e}")
+        await callback.message.answer("⚠️ Не удалось загрузить подписки")
+    finally:
+        await callback.answer()
+
+@router.callback_query(F.data.startswith("sub_"))
+async def toggle_subscription(callback: CallbackQuery):
+    try:
+        app = callback.data.removeprefix("sub_")
+        if app not in graphs.APPS:
+            await callback.answer("Неизвестный сервис")
+            return
+        user_id = callback.from_user.id
+        enabled = not await db.is_subscribed(user_id, app)
+        await db.set_subscription(user_id, app, enabled)
+        await callback.message.edit_reply_markup(reply_markup=subscriptions_menu(user_id))
+        title = graphs.APPS[app]
+        await callback.answer(f"🔔 Подписка на {title} включена" if enabled else f"🔕 Подписка на {title} отключена")
+    except Exception as e:
+        logger.error(f"Ошибка в toggle_subscription: {e}")
+        await callback.answer("⚠️ Не удалось изменить подписку")
+
 @router.message(F.text == "/me")
 async def user_info(message: Message):
     await send_user_info(message.from_user.id, message)
@@ -277,7 +534,7 @@ async def receive_new_name(message: Message, state: FSMContext):
         if len(new_name) > 50:
             await message.answer("Имя слишком длинное. Попробуйте покороче.")
             return
-        db.update_user_name(message.from_user.id, new_name)
+        await db.update_user_name(message.from_user.id, new_name)
         await message.answer(f"✅ Имя обновлено на: {new_name}")
         await state.clear()
         await send_user_info(message.from_user.id, message)
@@ -291,20 +548,24 @@ async def cmd_broadcast(message: Message, state: FSMContext):
         if message.from_user.id not in config.ADMIN_IDS:
             await message.reply("⚠️ Эта команда только для администраторов.")
             return
-        await message.answer("✉️ Отправьте ваше сообщение (можно с медиа и кнопками):")
-        await state.set_state(BroadcastStates.WaitingForMessage)
+        await begin_broadcast(message, state)
     except Exception as e:
         logger.error(f"Ошибка в cmd_broadcast: {e}")
         await message.answer("⚠️ Произошла ошибка")
 
+async def begin_broadcast(message: Message, state: FSMContext):
+    await message.answer("✉️ Отправьте ваше сообщение (можно с медиа и кнопками):")
+    await state.set_state(BroadcastStates.WaitingForMessage)
+
 @router.message(BroadcastStates.WaitingForMessage)
 async def receive_broadcast_message(message: Message, state: FSMContext):
     try:
-        await state.update_data(message=message)
-        kb = InlineKeyboardMarkup().add(
-            InlineKeyboardButton("✅ Отправить сообщение", callback_data="broadcast_send"),
-            InlineKeyboardButton("✒️ Отредактировать сообщение", callback_data="broadcast_edit")
-        )
+        # В состоянии только координаты сообщения: рассылка копирует его по id
+        await state.update_data(chat_id=message.chat.id, message_id=message.message_id)
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Отправить сообщение", callback_data="broadcast_send")],
+            [InlineKeyboardButton(text="✒️ Отредактировать сообщение", callback_data="broadcast_edit")],
+        ])
         await message.answer("<b>Предпросмотр подготовлен.</b>\n\nВы хотите отправить сообщение или изменить?", reply_markup=kb)
         await state.set_state(BroadcastStates.ConfirmingMessage)
     except Exception as e:
@@ -325,10 +586,10 @@ async def edit_broadcast(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "broadcast_send", BroadcastStates.ConfirmingMessage)
 async def send_broadcast(callback: CallbackQuery, state: FSMContext):
     try:
-        confirm_kb = InlineKeyboardMarkup().add(
-            InlineKeyboardButton("✅ Да, отправить", callback_data="broadcast_confirm"),
-            InlineKeyboardButton("❌ Отмена", callback_data="broadcast_cancel")
-        )
+        confirm_kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="✅ Да, отправить", callback_data="broadcast_confirm"),
+            InlineKeyboardButton(text="❌ Отмена", callback_data="broadcast_cancel"),
+        ]])
         await callback.message.edit_text(
             "⚠️ Вы уверены, что хотите разослать это сообщение ВСЕМ пользователям?",
             reply_markup=confirm_kb
@@ -337,59 +598,129 @@ async def send_broadcast(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Ошибка в send_broadcast: {e}")
         await callback.answer("⚠️ Произошла ошибка")
 
+def format_eta(seconds):
+    if seconds is None:
+        return "—"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}ч {minutes:02d}м" if hours else f"{minutes}м {seconds:02d}с"
+
+def format_broadcast_progress(result, title):
+    return (
+        f"{title}\n"
+        f"Прогресс: {result.processed}/{result.total}\n"
+        f"✔️ Доставлено: {result.success}\n"
+        f"❌ Заблокировали бота: {result.blocked}\n"
+        f"⚠️ Ошибок: {result.errors}\n"
+        f"🚀 Скорость: {result.rate:.1f} сообщ./с\n"
+        f"⏳ Осталось: {format_eta(result.eta)}"
+    )
+
+async def broadcast_progress(job, result):
+    if job["status_chat_id"] and job["status_message_id"]:
+        await bot.edit_message_text(
+            format_broadcast_progress(result, f"⏳ Рассылка #{job['id']} в процессе..."),
+            chat_id=job["status_chat_id"],
+            message_id=job["status_message_id"],
+        )
+
+async def broadcast_finished(job, result):
+    text = (
+        format_broadcast_progress(result, f"✅ Рассылка #{job['id']} завершена!")
+        + f"\n⏱ Время: {result.elapsed:.1f} с"
+    )
+    try:
+        if job["status_chat_id"] and job["status_message_id"]:
+            await bot.edit_message_text(
+                text, chat_id=job["status_chat_id"], message_id=job["status_message_id"]
+            )
+        elif job["created_by"]:
+            await bot.send_message(job["created_by"], text)
+    except Exception as e:
+        logger.error(f"Ошибка отправки итога рассылки #{job['id']}: {e}")
+
+broadcast_worker = broadcast.BroadcastWorker(
+    bot,
+    on_progress=broadcast_progress,
+    on_finish=broadcast_finished,
+    on_blocked=db.block_user,
+)
+
+async def alert_subscribers(service, text):
+    # Оповещение идет обычной рассылкой: исходное сообщение отправляется в ADMIN_LOG_ID
+    # и копируется подписчикам сервиса тем же обработчиком рассылок
+    if not ADMIN_LOG_ID or not await db.get_subscriber_count(service):
+        return None
+    title = graphs.APPS.get(service, service)
+    source = await bot.send_message(ADMIN_LOG_ID, f"🚨 <b>{html.escape(title)}</b>\n{html.escape(text)}")
+    return await broadcast_worker.submit(source.chat.id, source.message_id, service=service)
+
+async def on_outage_spike(spike):
+    await alert_subscribers(spike.service, spike.text)
+
+outage_monitor = outages.OutageMonitor(on_spike=on_outage_spike)
+
+@metrics.register_collector
+def collect_runtime_metrics():
+    samples = []
+    for name, st in db.cache_stats().items():
+        samples.append(("bot_cache_hits_total", {"cache": name}, st["hits"]))
+        samples.append(("bot_cache_misses_total", {"cache": name}, st["misses"]))
+        samples.append(("bot_cache_size", {"cache": name}, st["size"]))
+    queue = update_scheduler.stats()
+    for lane in (scheduler.HIGH, scheduler.NORMAL):
+        samples.append(("bot_update_queue_depth", {"lane": lane}, queue[lane]))
+    samples.append(("bot_update_workers_busy", {}, queue["running"]))
+    if broadcast_worker.current:
+        job, result = broadcast_worker.current
+        samples.append(("bot_broadcast_processed", {"job": job["id"]}, result.processed))
+        samples.append(("bot_broadcast_rate", {"job": job["id"]}, round(result.rate, 2)))
+    return samples
+
 @router.callback_query(F.data == "broadcast_confirm")
 async def confirm_broadcast(callback: CallbackQuery, state: FSMContext):
     try:
         data = await state.get_data()
-        src_msg: Message = data["message"]
-        
-        await callback.message.edit_text("⏳ Рассылка начата...")
-        
-        success, blocked, errors = 0, 0, 0
-        users = db.get_all_users()
-        total = len(users)
-        
-        for i, user in enumerate(users, 1):
-            try:
-                if src_msg.photo:
-                    await bot.send_photo(user["user_id"], src_msg.photo[-1].file_id, caption=src_msg.caption or src_msg.text or "")
-                elif src_msg.document:
-                    await bot.send_document(user["user_id"], src_msg.document.file_id, caption=src_msg.caption or src_msg.text or "")
-                elif src_msg.video:
-                    await bot.send_video(user["user_id"], src_msg.video.file_id, caption=src_msg.caption or src_msg.text or "")
-                else:
-                    await bot.send_message(user["user_id"], src_msg.text or "")
-                success += 1
-                
-                if i % 10 == 0:
-                    await callback.message.edit_text(
-                        f"⏳ Рассылка в процессе...\n"
-                        f"Прогресс: {i}/{total}\n"
-                        f"✔️ Доставлено: {success}\n"
-                        f"❌ Заблокировали бота: {blocked}\n"
-                        f"⚠️ Ошибок: {errors}"
-                    )
-                    
-            except TelegramForbiddenError:
-                blocked += 1
-                db.block_user(user["user_id"])
-            except Exception as e:
-                errors += 1
-                logger.error(f"Ошибка при рассылке {user['user_id']}: {e}")
 
-        await callback.message.edit_text(
-            f"✅ Рассылка завершена!\n"
-            f"Всего пользователей: {total}\n"
-            f"✔️ Доставлено: {success}\n"
-            f"❌ Заблокировали бота: {blocked}\n"
-            f"⚠️ Ошибок: {errors}"
+        # Задание сохраняется в БД и переживает перезапуск; исходное сообщение копируется по id
+        await callback.message.edit_text("⏳ Рассылка поставлена в очередь...")
+        job_id = await broadcast_worker.submit(
+            data["chat_id"],
+            data["message_id"],
+            created_by=callback.from_user.id,
+            status_chat_id=callback.message.chat.id,
+            status_message_id=callback.message.message_id,
         )
+        logger.info(f"Рассылка #{job_id} создана администратором {callback.from_user.id}")
     except Exception as e:
         logger.error(f"Ошибка в confirm_broadcast: {e}")
         await callback.message.edit_text("⚠️ Произошла критическая ошибка при рассылке")
     finally:
         await state.clear()
 
+@router.callback_query(F.data == "admin_broadcasts")
+async def admin_broadcasts(callback: CallbackQuery):
+    if callback.from_user.id not in config.ADMIN_IDS:
+        await callback.answer("⚠️ Только для администраторов.")
+        return
+    try:
+        lines = ["📬 <b>Рассылки:</b>"]
+        if broadcast_worker.current:
+            job, result = broadcast_worker.current
+            lines.append(format_broadcast_progress(result, f"\n⏳ Идет рассылка #{job['id']}"))
+        for job in await db.get_recent_broadcast_jobs():
+            processed = job["sent"] + job["blocked"] + job["failed"]
+            lines.append(
+                f"#{job['id']} {job['status']}: {processed}/{job['total']}, "
+                f"доставлено {job['sent']}, заблокировали {job['blocked']}, ошибок {job['failed']}"
+            )
+        await callback.message.answer("\n".join(lines))
+    except Exception as e:
+        logger.error(f"Ошибка в admin_broadcasts: {e}")
+        await callback.message.answer("⚠️ Не удалось загрузить рассылки")
+    finally:
+        await callback.answer()
+
 @router.callback_query(F.data == "broadcast_cancel")
 async def cancel_broadcast(callback: CallbackQuery, state: FSMContext):
     try:
@@ -400,14 +731,46 @@ async def cancel_broadcast(callback: CallbackQuery, state: FSMContext):
         await state.clear()
 
 async def main():
+    metrics_runner = None
     try:
-        db.init_db()
+        await db.init_db()
+        await db.warm_user_cache()
         dp.include_router(router)
-        await dp.start_polling(bot)
+        update_scheduler.start()
+        notifier.start()
+        broadcast_worker.start()
+        outage_monitor.start()
+        if config.METRICS_PORT:
+            metrics_runner = await metrics.start_metrics_server(
+                config.METRICS_HOST, config.METRICS_PORT, config.METRICS_TOKEN
+            )
+        if config.UPDATE_MODE == "webhook":
+            await webhook.run_webhook(
+                dp,
+                bot,
+                config.WEBHOOK_BASE_URL,
+                config.WEBHOOK_PATH,
+                config.WEBHOOK_SECRET,
+                config.WEBAPP_HOST,
+                config.WEBAPP_PORT,
+            )
+        else:
+            # Иначе getUpdates вернет конфликт, если раньше работал webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except Exception as e:
         logger.critical(f"Ошибка запуска бота: {e}")
+        await notifier.critical(f"Ошибка запуска бота: {e}")
     finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await outage_monitor.stop()
+        await broadcast_worker.stop()
+        await update_scheduler.stop(config.UPDATE_DRAIN_TIMEOUT)
+        await notifier.stop()
+        await db.close_db()
         await bot.session.close()
+        log_utils.stop_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,4 +1,5 @@
 const puppeteer = require('puppeteer');
+const crypto = require('crypto');
 const fs = require('fs');
 const path = require('path');
 
@@ -10,23 +11,111 @@ const apps = {
   tiktok: 'https://downdetector.su/tiktok',
 };
 
-async function generateGraph(appName) {
-  const url = apps[appName];
-  if (!url) {
-    console.error(`Unknown app: ${appName}`);
-    process.exit(1);
-  }
+// Для проверки на локальных HTML-фикстурах: GRAPH_URL_TEMPLATE=http://127.0.0.1:8000/graph.html?app={app}
+const URL_TEMPLATE = process.env.GRAPH_URL_TEMPLATE;
+const OUTPUT_DIR = path.resolve(process.env.GRAPH_OUTPUT_DIR || path.join(__dirname, 'graphs'));
+const INTERVAL_SEC = parseInt(process.env.GRAPH_INTERVAL || '300', 10);
+const PAGE_POOL_SIZE = parseInt(process.env.GRAPH_PAGES || '2', 10);
+const NAV_TIMEOUT_MS = parseInt(process.env.GRAPH_TIMEOUT_MS || '30000', 10);
+
+function appUrl(appName) {
+  if (URL_TEMPLATE) return URL_TEMPLATE.replace('{app}', encodeURIComponent(appName));
+  return apps[appName];
+}
 
-  const browser = await puppeteer.launch({
+function writeAtomic(filePath, data) {
+  // Бот никогда не увидит недописанный файл: пишем во временный и переименовываем
+  const tmpPath = `${filePath}.${process.pid}.tmp`;
+  fs.writeFileSync(tmpPath, data);
+  fs.renameSync(tmpPath, filePath);
+}
+
+async function launchBrowser() {
+  return puppeteer.launch({
     headless: true,
     args: ['--no-sandbox', '--disable-setuid-sandbox']
   });
+}
 
-  const page = await browser.newPage();
-  await page.setViewport({ width: 900, height: 500 });
+class PagePool {
+  constructor(browser, size) {
+    this.browser = browser;
+    this.size = size;
+    this.idle = [];
+    this.created = 0;
+    this.waiters = [];
+  }
+
+  async acquire() {
+    if (this.idle.length) return this.idle.pop();
+    if (this.created < this.size) {
+      this.created += 1;
+      const page = await this.browser.newPage();
+      await page.setViewport({ width: 900, height: 500 });
+      return page;
+    }
+    return new Promise(resolve => this.waiters.push(resolve));
+  }
 
+  release(page) {
+    const waiter = this.waiters.shift();
+    if (waiter) waiter(page);
+    else this.idle.push(page);
+  }
+}
+
+// Точки графика (epoch-секунды, число жалоб) из объекта диаграммы на странице.
+// Выполняется в браузере: поддерживаются Chart.js и Highcharts.
+function extractSeries() {
+  const toEpoch = value => {
+    if (typeof value === 'number') return Math.floor(value > 1e12 ? value / 1000 : value);
+    const parsed = Date.parse(value);
+    return Number.isNaN(parsed) ? null : Math.floor(parsed / 1000);
+  };
+  const points = [];
+  const push = (x, y) => {
+    const ts = toEpoch(x);
+    const count = Number(y);
+    if (ts !== null && Number.isFinite(count)) points.push([ts, Math.round(count)]);
+  };
+
+  const chartjs = window.Chart && window.Chart.instances ? Object.values(window.Chart.instances) : [];
+  for (const chart of chartjs) {
+    const dataset = chart.data && chart.data.datasets && chart.data.datasets[0];
+    if (!dataset) continue;
+    const labels = chart.data.labels || [];
+    dataset.data.forEach((p, i) => {
+      if (p !== null && typeof p === 'object') push(p.x, p.y);
+      else push(labels[i], p);
+    });
+    if (points.length) return points;
+  }
+
+  const highcharts = window.Highcharts ? window.Highcharts.charts.filter(Boolean) : [];
+  for (const chart of highcharts) {
+    const series = chart.series && chart.series[0];
+    if (!series) continue;
+    series.data.forEach(p => push(p.x, p.y));
+    if (points.length) return points;
+  }
+  return points;
+}
+
+async function captureGraph(pool, appName) {
+  const url = appUrl(appName);
+  if (!url) throw new Error(`Unknown app: ${appName}`);
+
+  const page = await pool.acquire();
   try {
-    await page.goto(url, { waitUntil: 'networkidle2' });
+    await page.goto(url, { waitUntil: 'domcontentloaded', timeout: NAV_TIMEOUT_MS });
+    await page.waitForSelector('canvas', { timeout: NAV_TIMEOUT_MS });
+    // Даём графику догрузить данные, но не ждём бесконечно
+    await page.waitForNetworkIdle({ idleTime: 500, timeout: NAV_TIMEOUT_MS }).catch(() => {});
+
+    const points = await page.evaluate(extractSeries).catch(err => {
+      console.error(`⚠️ Series not extracted for ${appName}:`, err.message);
+      return [];
+    });
 
     // Удаление водяных знаков
     await page.evaluate(() => {
@@ -34,34 +123,108 @@ async function generateGraph(appName) {
       credits.forEach(el => el.remove());
     });
 
-    // Ожидание и выбор canvas-графика
-    await page.waitForSelector('canvas');
     const graph = await page.$('canvas');
-
     if (!graph) {
       throw new Error('График (canvas) не найден на странице');
     }
 
-    const outputDir = path.resolve(__dirname, 'graphs');
-    if (!fs.existsSync(outputDir)) fs.mkdirSync(outputDir);
+    const png = await graph.screenshot({ type: 'png' });
+    fs.mkdirSync(OUTPUT_DIR, { recursive: true });
 
-    const filePath = path.join(outputDir, `${appName}_graph.png`);
-    await graph.screenshot({ path: filePath });
+    const filePath = path.join(OUTPUT_DIR, `${appName}_graph.png`);
+    const meta = {
+      app: appName,
+      url,
+      captured_at: Math.floor(Date.now() / 1000),
+      sha256: crypto.createHash('sha256').update(png).digest('hex'),
+      size: png.length,
+    };
+    writeAtomic(filePath, png);
+    // Метаданные пишутся после PNG: свежий sha256 всегда соответствует файлу на диске
+    writeAtomic(path.join(OUTPUT_DIR, `${appName}_graph.json`), JSON.stringify(meta));
+    if (points.length) {
+      // Числа за графиком бот загружает в таблицу outage_samples (outages.py)
+      const series = { app: appName, captured_at: meta.captured_at, points };
+      writeAtomic(path.join(OUTPUT_DIR, `${appName}_series.json`), JSON.stringify(series));
+    }
 
     console.log(`✅ Saved: ${filePath}`);
-  } catch (err) {
-    console.error('❌ Error generating graph:', err);
-    process.exit(1);
+    return meta;
   } finally {
-    await browser.close();
+    pool.release(page);
+  }
+}
+
+async function captureAll(pool, appNames) {
+  const results = await Promise.allSettled(appNames.map(name => captureGraph(pool, name)));
+  results.forEach((result, i) => {
+    if (result.status === 'rejected') {
+      console.error(`❌ Error generating graph for ${appNames[i]}:`, result.reason);
+    }
+  });
+  return results;
+}
+
+async function serve(appNames) {
+  let browser = null;
+  let pool = null;
+
+  const cycle = async () => {
+    // Один браузер на всё время работы; перезапускаем только если он упал
+    if (!browser || !browser.isConnected()) {
+      browser = await launchBrowser();
+      pool = new PagePool(browser, PAGE_POOL_SIZE);
+    }
+    const started = Date.now();
+    await captureAll(pool, appNames);
+    console.log(`🔁 Captured ${appNames.length} graphs in ${Date.now() - started} ms`);
+  };
+
+  const shutdown = async () => {
+    if (browser) await browser.close().catch(() => {});
+    process.exit(0);
+  };
+  process.on('SIGINT', shutdown);
+  process.on('SIGTERM', shutdown);
+
+  while (true) {
+    try {
+      await cycle();
+    } catch (err) {
+      console.error('❌ Capture cycle failed:', err);
+      if (browser) await browser.close().catch(() => {});
+      browser = null;
+    }
+    await new Promise(resolve => setTimeout(resolve, INTERVAL_SEC * 1000));
   }
 }
 
-const appName = process.argv[2];
-if (!appName) {
-  console.error('Usage: node make_graph.js <appName>');
-  process.exit(1);
+async function runOnce(appNames) {
+  const browser = await launchBrowser();
+  try {
+    const results = await captureAll(new PagePool(browser, PAGE_POOL_SIZE), appNames);
+    if (results.some(r => r.status === 'rejected')) process.exitCode = 1;
+  } finally {
+    await browser.close();
+  }
 }
 
-generateGraph(appName);
+module.exports = { apps, appUrl, PagePool, extractSeries, captureGraph, captureAll, serve };
 
+if (require.main === module) {
+  const arg = process.argv[2];
+  if (!arg) {
+    console.error('Usage: node make_graph.js <appName> | --all | --serve');
+    process.exit(1);
+  }
+  if (arg === '--serve') {
+    serve(Object.keys(apps));
+  } else if (arg === '--all') {
+    runOnce(Object.keys(apps));
+  } else if (!apps[arg]) {
+    console.error(`Unknown app: ${arg}`);
+    process.exit(1);
+  } else {
+    runOnce([arg]);
+  }
+}
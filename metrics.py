@@ -0,0 +1,205 @@
+import hmac
+import logging
+import time
+from collections import defaultdict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        # Верхняя граница корзины, в которую попадает квантиль
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+# Имя метрики -> (описание, метка, {значение метки: Histogram})
+_histograms = {
+    "bot_handler_duration_seconds": ("Время обработки по хэндлерам", "handler", defaultdict(Histogram)),
+    "bot_db_query_duration_seconds": ("Время вызовов db.py", "query", defaultdict(Histogram)),
+    "bot_api_request_duration_seconds": ("Время запросов к Bot API", "method", defaultdict(Histogram)),
+    "bot_update_wait_seconds": ("Ожидание обновления в очереди планировщика", "lane", defaultdict(Histogram)),
+}
+_counters = {
+    "bot_handler_errors_total": ("Необработанные исключения в хэндлерах", "handler", defaultdict(int)),
+    "bot_api_errors_total": ("Ошибки запросов к Bot API", "method", defaultdict(int)),
+    "bot_updates_shed_total": ("Обновления, отброшенные при переполнении очереди", "lane", defaultdict(int)),
+}
+_gauges = {
+    "bot_handler_in_flight": ("Хэндлеры, выполняющиеся сейчас", "handler", defaultdict(int)),
+}
+# Функции, возвращающие [(имя, {метки}, значение)] на момент запроса метрик
+_collectors = []
+
+
+def observe(metric, label, seconds):
+    _histograms[metric][2][label].observe(seconds)
+
+
+def observe_db(query, seconds):
+    observe("bot_db_query_duration_seconds", query, seconds)
+
+
+def inc(metric, label, value=1):
+    _counters[metric][2][label] += value
+
+
+def register_collector(func):
+    _collectors.append(func)
+    return func
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def render_prometheus():
+    lines = []
+    for name, (help_text, label, series) in _histograms.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for value, hist in list(series.items()):
+            labels = f'{label}="{_escape(value)}"'
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{_format_bound(bound)}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {hist.sum}")
+            lines.append(f"{name}_count{{{labels}}} {hist.count}")
+    for kind, registry in (("counter", _counters), ("gauge", _gauges)):
+        for name, (help_text, label, series) in registry.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for value, number in list(series.items()):
+                lines.append(f'{name}{{{label}="{_escape(value)}"}} {number}')
+    for collector in _collectors:
+        try:
+            for name, labels, value in collector():
+                rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{rendered}}} {value}" if rendered else f"{name} {value}")
+        except Exception as e:
+            logger.error(f"Ошибка сборщика метрик {collector.__name__}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_ms(hist):
+    bound = hist.quantile(0.99)
+    if bound == float("inf"):
+        return f"> {hist.buckets[-2] * 1e3:.0f} мс"
+    return f"≤ {bound * 1e3:.0f} мс"
+
+
+def summary(limit=5):
+    # Короткая сводка для админ-панели: самые медленные по p99
+    sections = []
+    titles = {
+        "bot_handler_duration_seconds": "Хэндлеры",
+        "bot_db_query_duration_seconds": "БД",
+        "bot_api_request_duration_seconds": "Bot API",
+        "bot_update_wait_seconds": "Очередь обновлений",
+    }
+    for name, title in titles.items():
+        series = _histograms[name][2]
+        if not series:
+            continue
+        top = sorted(series.items(), key=lambda item: item[1].quantile(0.99), reverse=True)[:limit]
+        rows = [
+            f"{label}: n={hist.count}, ср. {hist.mean * 1e3:.1f} мс, p99 {_format_ms(hist)}"
+            for label, hist in top
+        ]
+        sections.append(f"<b>{title}:</b>\n" + "\n".join(rows))
+    in_flight = sum(_gauges["bot_handler_in_flight"][2].values())
+    errors = sum(_counters["bot_handler_errors_total"][2].values())
+    api_errors = sum(_counters["bot_api_errors_total"][2].values())
+    shed = sum(_counters["bot_updates_shed_total"][2].values())
+    sections.append(
+        f"Выполняется сейчас: {in_flight}, ошибок хэндлеров: {errors}, ошибок API: {api_errors}, "
+        f"отброшено при перегрузке: {shed}"
+    )
+    return "\n\n".join(sections)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        router = data.get("event_router")
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        name = f"{getattr(router, 'name', '?')}:{getattr(callback, '__name__', '?')}"
+
+        in_flight = _gauges["bot_handler_in_flight"][2]
+        in_flight[name] += 1
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            inc("bot_handler_errors_total", name)
+            raise
+        finally:
+            observe("bot_handler_duration_seconds", name, time.perf_counter() - start)
+            in_flight[name] -= 1
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            inc("bot_api_errors_total", name)
+            raise
+        finally:
+            observe("bot_api_request_duration_seconds", name, time.perf_counter() - start)
+
+
+async def handle_metrics(request):
+    token = request.app.get("token")
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        raise web.HTTPUnauthorized()
+    return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host, port, token=None):
+    app = web.Application()
+    app["token"] = token
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на {host}:{port}/metrics")
+    return runner
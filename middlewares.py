@@ -1,20 +1,103 @@
-from aiogram import types
-from aiogram.dispatcher.middlewares import BaseMiddleware
 import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, Update
 
 logger = logging.getLogger(__name__)
 
+class RateLimiterMiddleware(BaseMiddleware):
+    # GCRA: на пользователя хранится только теоретическое время прихода (TAT)
+    # и время последнего предупреждения, поэтому проверка и память — O(1) на пользователя.
+    def __init__(self, rate=1.0, burst=5, costs=None, max_users=100_000):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * burst
+        self.costs = costs or {}
+        self.max_users = max_users
+        self._state = OrderedDict()
+
+    def _cost(self, event):
+        if isinstance(event, Message):
+            key = (event.text or "").split(maxsplit=1)[0] if event.text else ""
+        elif isinstance(event, CallbackQuery):
+            key = event.data or ""
+        else:
+            return 1
+        if key in self.costs:
+            return self.costs[key]
+        # Ключи вида "refstats_" покрывают все callback_data с этим префиксом
+        for prefix, cost in self.costs.items():
+            if prefix.endswith("_") and key.startswith(prefix):
+                return cost
+        return 1
+
+    def _evict(self, now):
+        # Спереди лежат давно не обновлявшиеся записи; истекший TAT эквивалентен отсутствию записи
+        while self._state:
+            user_id, (tat, _) = next(iter(self._state.items()))
+            if tat > now and len(self._state) <= self.max_users:
+                break
+            del self._state[user_id]
+
+    def check(self, user_id, cost=1, now=None):
+        now = time.monotonic() if now is None else now
+        tat, warned_until = self._state.get(user_id, (now, 0.0))
+        new_tat = max(tat, now) + cost * self.interval
+        retry_after = new_tat - self.tolerance - now
+        if retry_after > 0:
+            return False, retry_after
+        self._state[user_id] = (new_tat, warned_until)
+        self._state.move_to_end(user_id)
+        self._evict(now)
+        return True, 0.0
+
+    def _should_warn(self, user_id, now, retry_after):
+        tat, warned_until = self._state.get(user_id, (now, 0.0))
+        if warned_until > now:
+            return False
+        self._state[user_id] = (tat, now + retry_after)
+        return True
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        allowed, retry_after = self.check(user.id, self._cost(event))
+        if allowed:
+            return await handler(event, data)
+
+        # Одно предупреждение за период ограничения, остальные события молча отбрасываются
+        if self._should_warn(user.id, time.monotonic(), retry_after):
+            text = f"⏳ Слишком много запросов, попробуйте через {max(1, round(retry_after))} с."
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif isinstance(event, Message):
+                await event.answer(text)
+        elif isinstance(event, CallbackQuery):
+            await event.answer()
+        return None
+
+    def __len__(self):
+        return len(self._state)
+
 class ErrorHandlerMiddleware(BaseMiddleware):
-    async def on_process_message(self, message: types.Message, data: dict):
-        try:
-            return await super().on_process_message(message, data)
-        except Exception as e:
-            logger.error(f"Ошибка обработки сообщения: {e}", exc_info=True)
-            await message.answer("⚠️ Произошла ошибка при обработке запроса")
+    def __init__(self, notify=None):
+        # notify(text) — немедленное уведомление администраторов о необработанной ошибке
+        self.notify = notify
 
-    async def on_process_callback_query(self, query: types.CallbackQuery, data: dict):
+    async def __call__(self, handler, event: Update, data):
         try:
-            return await super().on_process_callback_query(query, data)
+            return await handler(event, data)
         except Exception as e:
-            logger.error(f"Ошибка обработки callback: {e}", exc_info=True)
-            await query.answer("⚠️ Произошла ошибка при обработке запроса")
+            logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
+            if self.notify:
+                await self.notify(f"Необработанная ошибка: {type(e).__name__}: {e}")
+            try:
+                if event.message:
+                    await event.message.answer("⚠️ Произошла ошибка при обработке запроса")
+                elif event.callback_query:
+                    await event.callback_query.answer("⚠️ Произошла ошибка при обработке запроса")
+            except Exception as e:
+                logger.error(f"Не удалось сообщить пользователю об ошибке: {e}")
@@ -0,0 +1,122 @@
+import asyncio
+import html
+import logging
+import time
+from collections import Counter
+
+from aiogram import Bot
+
+import db
+
+logger = logging.getLogger(__name__)
+
+DIGEST_INTERVAL = 60
+DIGEST_MAX_ITEMS = 10
+# Одинаковая критическая ошибка отправляется сразу не чаще раза за это время,
+# повторы только подсчитываются в сводке
+CRITICAL_REPEAT_INTERVAL = 300
+
+
+class Notifier:
+    # Уведомления администраторам не отправляются из хэндлеров: события копятся
+    # и уходят одной сводкой раз в interval секунд. Критичные ошибки — сразу.
+    def __init__(self, bot: Bot, chat_id, interval=DIGEST_INTERVAL, max_items=DIGEST_MAX_ITEMS):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_items = max_items
+        self._signups = 0
+        self._referrers = Counter()
+        self._suppressed = 0
+        self._critical_sent = {}
+        self._since = time.monotonic()
+        self._task = None
+
+    def start(self):
+        if self.chat_id and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Накопленное за последний интервал не теряется при остановке
+        await self.flush()
+
+    def signup(self, user_id, referral_id=None):
+        self._signups += 1
+        if referral_id is not None and referral_id != user_id:
+            self._referrers[referral_id] += 1
+
+    async def critical(self, text):
+        if not self.chat_id:
+            return
+        now = time.monotonic()
+        sent_at = self._critical_sent.get(text)
+        if sent_at is not None and now - sent_at < CRITICAL_REPEAT_INTERVAL:
+            self._suppressed += 1
+            return
+        self._critical_sent[text] = now
+        for key in [k for k, t in self._critical_sent.items() if now - t >= CRITICAL_REPEAT_INTERVAL]:
+            del self._critical_sent[key]
+        await self._send(f"🚨 {html.escape(text)}")
+
+    async def _referrer_label(self, user_id):
+        try:
+            user = await db.get_user(user_id)
+        except db.DBError:
+            user = None
+        if user and user["name"]:
+            return f"{html.escape(user['name'])} (ID {user_id})"
+        return f"ID {user_id}"
+
+    async def render(self, signups, referrers, suppressed, elapsed):
+        if not signups and not suppressed:
+            return None
+        lines = []
+        if signups:
+            referred = sum(referrers.values())
+            lines.append(
+                f"👥 Новых пользователей за последние {max(1, round(elapsed / 60))} мин: {signups}"
+                + (f", по рефералке: {referred}" if referred else "")
+            )
+            top = referrers.most_common(self.max_items)
+            if top:
+                lines.append("Топ рефереров:")
+                for i, (user_id, count) in enumerate(top, 1):
+                    lines.append(f"{i}. {await self._referrer_label(user_id)} — {count}")
+                rest = len(referrers) - len(top)
+                if rest > 0:
+                    lines.append(f"…и еще {rest}")
+        if suppressed:
+            lines.append(f"⚠️ Повторов критичных ошибок скрыто: {suppressed}")
+        return "\n".join(lines)
+
+    async def flush(self):
+        if not self.chat_id:
+            return
+        # Счетчики обнуляются до отправки: события во время отправки попадут в следующую сводку
+        snapshot = (self._signups, self._referrers, self._suppressed, time.monotonic() - self._since)
+        self._signups, self._referrers, self._suppressed = 0, Counter(), 0
+        self._since = time.monotonic()
+        text = await self.render(*snapshot)
+        if text:
+            await self._send(text)
+
+    async def _send(self, text):
+        try:
+            await self.bot.send_message(self.chat_id, text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление администраторам: {e}")
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки: {e}")
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import db
+import graphs
+
+logger = logging.getLogger(__name__)
+
+# Шаг сетки и окно базовой линии: сутки истории при точках раз в 15 минут
+STEP = 15 * 60
+WINDOW = 96
+# Всплеск — робастный z-score выше порога при заметном числе жалоб
+THRESHOLD = 6.0
+MIN_COUNT = 50
+# Доля шагов окна, для которых есть данные; иначе базовая линия не считается
+MIN_COVERAGE = 0.5
+# Повторный инцидент по сервису не раньше чем через COOLDOWN секунд
+COOLDOWN = 3 * 3600
+# Инцидентами становятся только свежие всплески, старые точки лишь дополняют историю
+RECENT = 2 * 3600
+INTERVAL = 300
+# Столбцов сетки за один проход: память ~ сервисы * CHUNK * WINDOW * 8 байт
+CHUNK = 2048
+# MAD * 1.4826 оценивает стандартное отклонение нормального распределения
+MAD_SCALE = 1.4826
+
+
+@dataclass
+class Spike:
+    service: str
+    ts: int
+    count: int
+    baseline: float
+    score: float
+
+    @property
+    def text(self):
+        title = graphs.APPS.get(self.service, self.service)
+        return f"📈 {title}: всплеск жалоб — {self.count} (обычно ~{self.baseline:.0f})"
+
+
+def read_series(path):
+    # Файл <app>_series.json из make_graph.js: {"app": ..., "captured_at": ..., "points": [[ts, count], ...]}
+    with open(path, "r", encoding="utf-8") as f:
+        series = json.load(f)
+    return series["app"], [(int(ts), int(count)) for ts, count in series["points"]]
+
+
+def read_series_dir(directory=graphs.GRAPHS_DIR, services=graphs.APPS):
+    samples = []
+    for service in services:
+        path = os.path.join(directory, f"{service}_series.json")
+        try:
+            app, points = read_series(path)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Не удалось прочитать {path}: {e}")
+            continue
+        samples.extend((app, ts, count) for ts, count in points)
+    return samples
+
+
+def build_matrix(samples, services, step=STEP, start=None, end=None):
+    # Сетка сервисы x шаги; NaN — данных за шаг нет
+    index = {service: i for i, service in enumerate(services)}
+    data = np.array(
+        [(index[service], ts, count) for service, ts, count in samples if service in index],
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    if start is None:
+        start = int(data[:, 1].min()) // step * step if len(data) else 0
+    if end is None:
+        end = int(data[:, 1].max()) if len(data) else start
+    matrix = np.full((len(services), (end - start) // step + 1), np.nan)
+    cols = (data[:, 1] - start) // step
+    keep = (cols >= 0) & (cols < matrix.shape[1])
+    # Несколько точек в одном шаге: берется максимум
+    np.fmax.at(matrix, (data[keep, 0], cols[keep]), data[keep, 2].astype(np.float64))
+    return start, matrix
+
+
+def detect(matrix, window=WINDOW, threshold=THRESHOLD, min_count=MIN_COUNT,
+           min_coverage=MIN_COVERAGE, chunk=CHUNK):
+    # Для каждой точки — медиана и MAD предыдущих window шагов того же сервиса.
+    # Все сервисы считаются одной операцией, сетка обходится кусками по chunk столбцов.
+    services, steps = matrix.shape
+    observed = ~np.isnan(matrix)
+    values = np.where(observed, matrix, 0.0)
+    scores = np.zeros((services, steps))
+    baseline = np.full((services, steps), np.nan)
+    flags = np.zeros((services, steps), dtype=bool)
+    if steps <= window:
+        return scores, baseline, flags
+
+    for start in range(window, steps, chunk):
+        stop = min(steps, start + chunk)
+        # Окно точки t — values[:, t - window:t], текущая точка в базовую линию не входит
+        windows = sliding_window_view(values[:, start - window:stop - 1], window, axis=1)
+        median = np.median(windows, axis=2)
+        mad = np.median(np.abs(windows - median[..., None]), axis=2)
+        # Нижняя граница разброса — пуассоновская: при ровном фоне MAD бывает нулевым
+        scale = np.maximum(MAD_SCALE * mad, np.sqrt(median + 1.0))
+        scores[:, start:stop] = (values[:, start:stop] - median) / scale
+        baseline[:, start:stop] = median
+
+    cumulative = np.concatenate([np.zeros((services, 1)), np.cumsum(observed, axis=1)], axis=1)
+    coverage = (cumulative[:, window:steps] - cumulative[:, :steps - window]) / window
+    flags[:, window:] = (
+        observed[:, window:]
+        & (coverage >= min_coverage)
+        & (values[:, window:] >= min_count)
+        & (scores[:, window:] > threshold)
+    )
+    return scores, baseline, flags
+
+
+def find_spikes(matrix, services, start, step=STEP, **params):
+    # Серия подряд идущих отмеченных шагов — один всплеск с временем первого шага
+    scores, baseline, flags = detect(matrix, **params)
+    onset = flags.copy()
+    onset[:, 1:] &= ~flags[:, :-1]
+    rows, cols = np.nonzero(onset)
+    return [
+        Spike(
+            service=services[row],
+            ts=start + int(col) * step,
+            count=int(matrix[row, col]),
+            baseline=float(baseline[row, col]),
+            score=float(scores[row, col]),
+        )
+        for row, col in zip(rows, cols)
+    ]
+
+
+def detect_samples(samples, services=tuple(graphs.APPS), step=STEP, **params):
+    if not samples:
+        return []
+    services = list(services)
+    start, matrix = build_matrix(samples, services, step)
+    return find_spikes(matrix, services, start, step, **params)
+
+
+class OutageMonitor:
+    # Загружает ряды, которые пишет make_graph.js --serve, и превращает свежие всплески в инциденты
+    def __init__(self, directory=graphs.GRAPHS_DIR, services=tuple(graphs.APPS), interval=INTERVAL,
+                 on_spike=None):
+        self.directory = directory
+        self.services = list(services)
+        self.interval = interval
+        self.on_spike = on_spike
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self, now=None):
+        now = int(time.time()) if now is None else now
+        samples = await asyncio.to_thread(read_series_dir, self.directory, self.services)
+        if samples:
+            await db.add_outage_samples(samples)
+
+        # Окно базовой линии плюс интервал, в котором ищутся новые всплески
+        since = now - (WINDOW + 1) * STEP - RECENT
+        history = await db.get_outage_samples(self.services, since)
+        spikes = await asyncio.to_thread(detect_samples, history, self.services)
+
+        created = []
+        for spike in spikes:
+            if spike.ts < now - RECENT:
+                continue
+            last = await db.get_last_incident_ts(spike.service)
+            if last is not None and spike.ts - last < COOLDOWN:
+                continue
+            await db.add_incident(spike.text, spike.service, spike.ts)
+            logger.warning(f"Автоинцидент {spike.service}: {spike.count} жалоб, z={spike.score:.1f}")
+            created.append(spike)
+            if self.on_spike:
+                try:
+                    await self.on_spike(spike)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки всплеска {spike.service}: {e}")
+        return created
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка детектора сбоев: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+
+if __name__ == "__main__":
+    # Проверка на записанных рядах без БД: python outages.py fixtures/series
+    import sys
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else graphs.GRAPHS_DIR
+    found = detect_samples(read_series_dir(directory))
+    for spike in found:
+        print(f"{time.strftime('%Y-%m-%d %H:%M', time.gmtime(spike.ts))} UTC  "
+              f"{spike.service:<10} count={spike.count:<6} baseline={spike.baseline:<7.1f} z={spike.score:.1f}")
+    print(f"{len(found)} spikes")
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HIGH = "high"
+NORMAL = "normal"
+BUSY_TEXT = "⏳ Бот сейчас перегружен, попробуйте через минуту."
+# Не чаще одного ответа «попробуйте позже» в чат за это время
+BUSY_WARN_INTERVAL = 10.0
+# Сколько секунд при остановке ждать обработки уже принятых обновлений
+DRAIN_TIMEOUT = 10.0
+
+
+class UpdateScheduler(BaseMiddleware):
+    # Внешний middleware dp.update: обновление ставится в очередь, а хэндлеры выполняет
+    # фиксированный пул воркеров. Обновления одного чата идут строго по порядку —
+    # следующее не начнется, пока не закончилось предыдущее, поэтому шаги FSM не гоняются.
+    # Чаты администраторов обслуживаются из отдельной очереди раньше остальных.
+    # Очередь чата не длиннее max_per_chat: флуд одного чата отклоняется раньше, чем
+    # общий предел max_queue, и не вызывает отказов остальным.
+    def __init__(self, workers=16, max_queue=1000, max_per_chat=10, admin_ids=(), busy_text=BUSY_TEXT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_chat = max_per_chat
+        self.admin_ids = set(admin_ids)
+        self.busy_text = busy_text
+        self.depth = {HIGH: 0, NORMAL: 0}
+        self.running = 0
+        self.shed = 0
+        # Чат -> очередь его обновлений; чат в _chats ждет в полосе или обрабатывается прямо сейчас
+        self._chats = {}
+        self._lanes = {HIGH: deque(), NORMAL: deque()}
+        self._ready = asyncio.Semaphore(0)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._warned = OrderedDict()
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=DRAIN_TIMEOUT):
+        # Обновления в очереди Telegram уже считает доставленными: перед отменой воркеров
+        # даем им доработать, иначе они пропадут без ответа
+        if self._tasks and not self._idle.is_set():
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"При остановке не обработано обновлений: {self.pending + self.running}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def pending(self):
+        return self.depth[HIGH] + self.depth[NORMAL]
+
+    def stats(self):
+        return {
+            **self.depth,
+            "pending": self.pending,
+            "running": self.running,
+            "chats": len(self._chats),
+            "shed": self.shed,
+        }
+
+    def _lane(self, data):
+        user = data.get("event_from_user")
+        return HIGH if user is not None and user.id in self.admin_ids else NORMAL
+
+    def _key(self, event, data):
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        if user is not None:
+            return user.id
+        # Обновления без чата и пользователя упорядочивать не с чем
+        return ("update", getattr(event, "update_id", id(event)))
+
+    async def __call__(self, handler, event, data):
+        if not self._tasks:
+            return await handler(event, data)
+
+        lane = self._lane(data)
+        key = self._key(event, data)
+        queue = self._chats.get(key)
+        if lane == NORMAL and (
+            self.pending >= self.max_queue or (queue is not None and len(queue) >= self.max_per_chat)
+        ):
+            self.shed += 1
+            metrics.inc("bot_updates_shed_total", lane)
+            await self._reject(event, data)
+            return None
+
+        item = (handler, event, data, lane, time.perf_counter())
+        self.depth[lane] += 1
+        self._idle.clear()
+        if queue is not None:
+            # Чат уже в очереди или обрабатывается: обновление подождет своей очереди в чате
+            queue.append(item)
+            return None
+        self._chats[key] = deque([item])
+        self._lanes[lane].append(key)
+        self._ready.release()
+        return None
+
+    async def _reject(self, event: Update, data):
+        key = self._key(event, data)
+        now = time.monotonic()
+        warned_at = self._warned.get(key)
+        quiet = warned_at is not None and now - warned_at < BUSY_WARN_INTERVAL
+        if not quiet:
+            self._warned[key] = now
+            self._warned.move_to_end(key)
+            while len(self._warned) > self.max_queue:
+                self._warned.popitem(last=False)
+        try:
+            if quiet:
+                # Кнопка не должна крутиться, но повторное предупреждение не нужно
+                if event.callback_query:
+                    await event.callback_query.answer()
+            elif event.callback_query:
+                await event.callback_query.answer(self.busy_text)
+            elif event.message:
+                await event.message.answer(self.busy_text)
+        except Exception as e:
+            logger.error(f"Не удалось ответить о перегрузке: {e}")
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            key = (self._lanes[HIGH] or self._lanes[NORMAL]).popleft()
+            queue = self._chats[key]
+            handler, event, data, lane, enqueued_at = queue[0]
+            self.depth[lane] -= 1
+            self.running += 1
+            metrics.observe("bot_update_wait_seconds", lane, time.perf_counter() - enqueued_at)
+            try:
+                # FSMContextMiddleware прочитал состояние при постановке в очередь; предыдущее
+                # обновление чата могло его сменить, поэтому фильтры должны видеть текущее
+                if "state" in data:
+                    data["raw_state"] = await data["state"].get_state()
+                await handler(event, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления в очереди: {e}", exc_info=True)
+            finally:
+                self.running -= 1
+                queue.popleft()
+                if queue:
+                    # Следующее обновление чата встает в полосу своего приоритета
+                    self._lanes[queue[0][3]].append(key)
+                    self._ready.release()
+                else:
+                    del self._chats[key]
+                if not self._chats:
+                    self._idle.set()
@@ -0,0 +1,65 @@
+import json
+import logging
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Брошенные диалоги (не дописали имя, не подтвердили рассылку) исчезают через час
+STATE_TTL = 3600
+PURGE_INTERVAL = 600
+
+
+class SQLiteStorage(BaseStorage):
+    # FSM в таблице fsm_storage той же базы: состояния переживают перезапуск
+    # и видны всем процессам бота. Данные хранятся в JSON, поэтому класть в них
+    # можно только простые значения (id, строки), а не объекты aiogram.
+    def __init__(self, ttl=STATE_TTL, purge_interval=PURGE_INTERVAL):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._purged_at = time.monotonic()
+
+    @staticmethod
+    def _key(key: StorageKey):
+        parts = [key.bot_id, key.chat_id, key.user_id]
+        if key.thread_id:
+            parts.append(f"t{key.thread_id}")
+        business_connection_id = getattr(key, "business_connection_id", None)
+        if business_connection_id:
+            parts.append(f"b{business_connection_id}")
+        parts.append(key.destiny)
+        return ":".join(str(part) for part in parts)
+
+    async def _maybe_purge(self):
+        # Истекшие записи и так не читаются; удаляем их пачкой не чаще purge_interval
+        if time.monotonic() - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = time.monotonic()
+        removed = await db.purge_fsm()
+        if removed:
+            logger.info(f"Удалено просроченных состояний FSM: {removed}")
+
+    async def set_state(self, key: StorageKey, state=None):
+        value = state.state if isinstance(state, State) else state
+        await db.set_fsm_state(self._key(key), value, self.ttl)
+        await self._maybe_purge()
+
+    async def get_state(self, key: StorageKey):
+        state, _ = await db.get_fsm_record(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data):
+        await db.set_fsm_data(self._key(key), json.dumps(dict(data), ensure_ascii=False), self.ttl)
+        await self._maybe_purge()
+
+    async def get_data(self, key: StorageKey):
+        _, data = await db.get_fsm_record(self._key(key))
+        return json.loads(data)
+
+    async def close(self):
+        # Соединение принадлежит db.py и закрывается в db.close_db
+        pass
@@ -0,0 +1,117 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery, Message, Update
+
+from benchmarks.fake_telegram import BOT_TOKEN, FakeTelegram, make_callback_update, make_message_update
+from scheduler import UpdateScheduler
+
+
+class EditNameState(StatesGroup):
+    WaitingForName = State()
+
+
+def build(scheduler, seen):
+    router = Router()
+
+    @router.callback_query(F.data == "edit_name")
+    async def edit_name(callback: CallbackQuery, state: FSMContext):
+        # Пока хэндлер работает, следующее сообщение чата уже стоит в очереди
+        await asyncio.sleep(0.05)
+        await state.set_state(EditNameState.WaitingForName)
+        seen.append("set")
+
+    @router.message(EditNameState.WaitingForName)
+    async def receive_name(message: Message, state: FSMContext):
+        await state.clear()
+        seen.append(f"name:{message.text}")
+
+    @router.message(F.text.startswith("slow"))
+    async def slow(message: Message):
+        await asyncio.sleep(0.05)
+        seen.append(f"slow:{message.chat.id}")
+
+    @router.message()
+    async def fallthrough(message: Message):
+        seen.append(f"fallthrough:{message.text}")
+
+    dp = Dispatcher()
+    dp.update.outer_middleware(scheduler)
+    dp.include_router(router)
+    return dp
+
+
+async def feed(dp, bot, raw):
+    await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+
+
+async def drain(scheduler):
+    while scheduler.pending or scheduler.running:
+        await asyncio.sleep(0.01)
+
+
+def test_state_set_by_previous_update_is_seen():
+    # Регрессия: состояние читалось при постановке в очередь, и имя уходило в общий хэндлер
+    async def scenario():
+        seen = []
+        scheduler = UpdateScheduler(workers=4)
+        dp = build(scheduler, seen)
+        bot = Bot(BOT_TOKEN)
+        scheduler.start()
+        try:
+            await feed(dp, bot, make_callback_update(1, 7, "edit_name"))
+            await feed(dp, bot, make_message_update(2, 7, "Bob"))
+            await drain(scheduler)
+        finally:
+            await scheduler.stop()
+            await bot.session.close()
+        return seen
+
+    assert asyncio.run(scenario()) == ["set", "name:Bob"]
+
+
+def test_flooding_chat_does_not_shed_other_chats():
+    async def scenario():
+        seen = []
+        scheduler = UpdateScheduler(workers=2, max_queue=20, max_per_chat=5)
+        dp = build(scheduler, seen)
+        fake = FakeTelegram()
+        bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(await fake.start())))
+        scheduler.start()
+        try:
+            for update_id in range(1, 51):
+                await feed(dp, bot, make_message_update(update_id, 7, "slow"))
+            await feed(dp, bot, make_message_update(100, 8, "slow"))
+            await drain(scheduler)
+        finally:
+            await scheduler.stop()
+            await bot.session.close()
+            await fake.stop()
+        return seen, scheduler.shed, fake.calls
+
+    seen, shed, calls = asyncio.run(scenario())
+    assert seen.count("slow:7") == 5
+    assert shed == 45
+    assert "slow:8" in seen
+    # Флудящему чату — одно предупреждение, а не по ответу на каждое отброшенное обновление
+    assert calls.get("sendMessage") == 1
+
+
+def test_stop_drains_queued_updates():
+    async def scenario():
+        seen = []
+        scheduler = UpdateScheduler(workers=1)
+        dp = build(scheduler, seen)
+        bot = Bot(BOT_TOKEN)
+        scheduler.start()
+        for update_id, chat_id in enumerate(range(10, 15), 1):
+            await feed(dp, bot, make_message_update(update_id, chat_id, "slow"))
+        await scheduler.stop(timeout=5)
+        await bot.session.close()
+        return seen
+
+    assert len(asyncio.run(scenario())) == 5
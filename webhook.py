@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+async def _health(request):
+    return web.Response(text="ok")
+
+def build_app(dp: Dispatcher, bot: Bot, path, secret):
+    app = web.Application()
+    # Обновление подтверждается сразу, а обрабатывается в фоновой задаче;
+    # запросы без правильного X-Telegram-Bot-Api-Secret-Token отклоняются с 401
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret,
+        handle_in_background=True,
+    ).register(app, path=path)
+    app.router.add_get("/health", _health)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def start_server(app, host, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+async def run_webhook(dp: Dispatcher, bot: Bot, base_url, path, secret, host, port):
+    if not base_url:
+        raise ValueError("Для режима webhook нужен WEBHOOK_BASE_URL")
+
+    # start_polling сам ловит сигналы, а здесь без обработчика SIGTERM (так останавливает Render)
+    # убил бы процесс, не дав main() сбросить очереди и закрыть БД
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    app = build_app(dp, bot, path, secret)
+    runner = await start_server(app, host, port)
+    try:
+        await bot.set_webhook(
+            base_url.rstrip("/") + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info(f"Webhook запущен на {host}:{port}{path}")
+        await stop.wait()
+        logger.info("Получен сигнал остановки, webhook завершает работу")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()